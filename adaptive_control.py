@@ -0,0 +1,116 @@
+import collections
+import threading
+import time
+
+# Réponses SMTP qui demandent de ralentir (service indisponible, limite temporaire)
+THROTTLE_CODES = {421, 450, 451, 452}
+# Une latence au-delà de ce multiple de la latence de référence est un signal de congestion
+LATENCY_TOLERANCE = 2.0
+# Réduction multiplicative de la fenêtre et du débit à chaque congestion
+DECREASE_FACTOR = 0.5
+# Délai minimal entre deux réductions (les réponses d'une même rafale ne comptent qu'une fois)
+DECREASE_COOLDOWN = 2.0
+# Augmentation additive du débit (envois/seconde) par réponse propre
+RATE_STEP = 0.2
+# Pause après une limitation, doublée à chaque limitation consécutive (secondes)
+THROTTLE_BACKOFF = 1.0
+MAX_THROTTLE_BACKOFF = 60.0
+
+class AdaptiveController:
+    """Régulation AIMD des envois d'un compte SMTP.
+
+    Deux grandeurs sont ajustées pendant la campagne : la fenêtre (nombre
+    d'envois simultanés, au plus `max_concurrency`) et le débit (envois par
+    seconde, illimité tant qu'aucune congestion n'a été vue). Chaque réponse
+    propre les augmente de façon additive ; une réponse 421/450/451/452 ou une
+    latence qui s'envole les divise par deux.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        # Démarrage prudent puis croissance rapide (+1 par réponse) jusqu'à la première congestion
+        self.window = float(min(2, self.max_concurrency))
+        self.slow_start = True
+        self.rate = None
+        self.latency = None
+        self.base_latency = None
+        self.throttles = 0
+        self.in_flight = 0
+        self._next_send = 0.0
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._completions = collections.deque(maxlen=50)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Attend une place dans la fenêtre et le créneau du débit courant"""
+        with self._cond:
+            while self.in_flight >= max(1, int(self.window)):
+                self._cond.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self._resume_at, self._next_send)
+            if self.rate:
+                self._next_send = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, latency=None, congested=False):
+        """Rend la place après un envoi.
+
+        `latency` est la durée de l'envoi quand le serveur a répondu proprement
+        (None sinon) ; `congested` signale une réponse de limitation.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if congested:
+                self._decrease(now)
+            elif latency is not None:
+                self._completions.append(now)
+                self.throttles = 0
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if len(self._completions) >= 5:
+                    self.base_latency = min(self.base_latency or self.latency, self.latency)
+                if self.base_latency and self.latency > self.base_latency * LATENCY_TOLERANCE:
+                    self._decrease(now)
+                else:
+                    self._increase()
+            self._cond.notify_all()
+
+    def throttled(self):
+        """Enregistre une limitation : pause des envois du compte, doublée à chaque limitation consécutive"""
+        with self._cond:
+            self.throttles += 1
+            backoff = min(MAX_THROTTLE_BACKOFF, THROTTLE_BACKOFF * 2 ** (self.throttles - 1))
+            self._resume_at = max(self._resume_at, time.monotonic() + backoff)
+
+    def observed_rate(self):
+        """Débit réellement obtenu sur les dernières réponses (envois/seconde)"""
+        if len(self._completions) < 2:
+            return None
+        elapsed = self._completions[-1] - self._completions[0]
+        return (len(self._completions) - 1) / elapsed if elapsed > 0 else None
+
+    def _increase(self):
+        if self.slow_start:
+            self.window += 1
+        else:
+            self.window += 1 / self.window
+        self.window = min(self.window, float(self.max_concurrency))
+        if self.rate is not None:
+            self.rate += RATE_STEP
+            observed = self.observed_rate()
+            # Le débit imposé ne limite plus rien : on le lève
+            if observed and self.rate > observed * 2:
+                self.rate = None
+
+    def _decrease(self, now):
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.slow_start = False
+        self.window = max(1.0, self.window * DECREASE_FACTOR)
+        current = self.rate or self.observed_rate()
+        if current:
+            self.rate = max(RATE_STEP, current * DECREASE_FACTOR)
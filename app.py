@@ -3,7 +3,7 @@ from data_manager import load_data
 from smtp_utils import smtp_config_section
 from template_utils import template_section
 from sms_utils import sms_config_section, sms_template_section
-from campaign_manager import campaign_section
+from campaign_manager import campaign_section, history_section
 from email_sender import send_email_section
 from sms_sender import send_sms_section
 
@@ -43,4 +43,4 @@ elif choice == "⚙️ Configuration SMS":
 elif choice == "📝 Templates Email & SMS":  # MODIFIÉ
     template_section()  # Maintenant gère email + SMS
 elif choice == "📊 Historique":
-    st.info("📊 Historique des campagnes (à venir)")
\ No newline at end of file
+    history_section()
\ No newline at end of file
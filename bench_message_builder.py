@@ -0,0 +1,71 @@
+import argparse
+import io
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from smtplib import _fix_eols
+
+from mime_builder import MessageBuilder
+from template_renderer import compile_template, extract_template_variables
+from email_sender import build_attachment_part
+
+SUBJECT = "Bonjour [Prénom], votre offre [Offre] vous attend"
+TEXT = "Bonjour [Prénom],\n\nDécouvrez [Offre] à [Ville].\n" * 20
+HTML = "<html><body><table>" + "<tr><td>Bonjour [Prénom], découvrez [Offre] à [Ville].</td></tr>" * 400 + "</table></body></html>"
+
+def legacy_build(email_dest, sender, subject, text, html, attachment_part):
+    """Ancien chemin : arbre MIMEMultipart + as_string() + ré-encodage en octets"""
+    message = MIMEMultipart("mixed")
+    message["From"] = sender
+    message["To"] = email_dest
+    message["Subject"] = subject
+    alternative = MIMEMultipart('alternative')
+    if text.strip():
+        alternative.attach(MIMEText(text, "plain"))
+    if html.strip():
+        alternative.attach(MIMEText(html, "html"))
+    message.attach(alternative)
+    if attachment_part is not None:
+        message.attach(attachment_part)
+    # Ce que fait smtplib.sendmail avec une chaîne
+    return _fix_eols(message.as_string()).encode("ascii")
+
+def bench_message_builder(count, attachment_size):
+    variables = extract_template_variables(SUBJECT, TEXT, HTML)
+    compiled_subject = compile_template(SUBJECT, "email", variables)
+    compiled_text = compile_template(TEXT, "email", variables)
+    compiled_html = compile_template(HTML, "email", variables)
+
+    attachment_part = None
+    if attachment_size:
+        attachment_file = io.BytesIO(b"\x00\x01brochure" * (attachment_size // 10))
+        attachment_file.name = "brochure.pdf"
+        attachment_part = build_attachment_part(attachment_file)
+
+    rows = [(f"contact{i}@example.com", (f"Prénom{i}", "Offre Premium", "Douala")) for i in range(count)]
+    print(f"📦 {count} messages, HTML {len(HTML) // 1024} Ko, pièce jointe {attachment_size // 1024} Ko")
+
+    start = time.perf_counter()
+    for email_dest, values in rows:
+        legacy_build(
+            email_dest, "contact@example.com",
+            compiled_subject.render(values), compiled_text.render(values), compiled_html.render(values),
+            attachment_part
+        )
+    legacy = count / (time.perf_counter() - start)
+    print(f"   Ancien chemin (MIMEMultipart + as_string) : {legacy:,.0f} messages/s")
+
+    builder = MessageBuilder(compiled_subject, compiled_text, compiled_html, attachment_part)
+    start = time.perf_counter()
+    for email_dest, values in rows:
+        builder.build(email_dest, values)
+    fast = count / (time.perf_counter() - start)
+    print(f"   MessageBuilder (octets)                   : {fast:,.0f} messages/s")
+    print(f"🚀 Gain : x{fast / legacy:.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de construction des messages email")
+    parser.add_argument("--count", type=int, default=2000, help="Nombre de messages à construire")
+    parser.add_argument("--attachment-size", type=int, default=200 * 1024, help="Taille de la pièce jointe en octets (0 pour aucune)")
+    args = parser.parse_args()
+    bench_message_builder(args.count, args.attachment_size)
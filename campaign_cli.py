@@ -0,0 +1,175 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+import pandas as pd
+
+from data_manager import load_data
+from sms_manager import load_sms_configs, load_sms_templates
+from contact_manager import CONTACT_CHUNK_SIZE, iter_channel_contacts
+from template_renderer import extract_template_variables
+from email_sender import send_email_campaign
+from sms_sender import send_sms_campaign, operator_routes
+from send_journal import get_send_journal, make_campaign_id, content_hash
+from progress_reporter import ConsoleProgress
+
+SPEC_EXAMPLE = """Exemple de fichier de campagne (JSON) :
+{
+    "name": "Promo rentrée",
+    "email": {"smtp": ["gmail_pro", "ovh"], "template": "Promo", "batch_identical": false, "render_processes": "auto"},
+    "sms": {"config": "orange", "template": "Promo SMS", "auto_route": true},
+    "var_mapping": {"Prénom": "prenom"},
+    "default_values": {"Prénom": "cher client"},
+    "attachment": "brochure.pdf"
+}"""
+
+def build_email_config(email_spec, smtp_configs, email_templates):
+    """Configuration d'envoi email à partir des noms de configurations SMTP et de template"""
+    smtp_names = email_spec["smtp"]
+    if isinstance(smtp_names, str):
+        smtp_names = [smtp_names]
+    accounts = [
+        {"name": name, "config": smtp_configs[name], "weight": smtp_configs[name].get("weight", 1)}
+        for name in smtp_names
+    ]
+    template = email_spec["template"]
+    return {
+        "smtp": ", ".join(smtp_names),
+        "template": template,
+        "config_data": accounts[0]["config"],
+        "template_data": email_templates[template],
+        "accounts": accounts,
+        "batch_identical": bool(email_spec.get("batch_identical")),
+        "batch_size": email_spec.get("batch_size"),
+        "render_processes": email_spec.get("render_processes")
+    }
+
+def build_sms_config(sms_spec, sms_configs, sms_templates):
+    """Configuration d'envoi SMS à partir des noms de configuration opérateur et de template"""
+    return {
+        "config": sms_spec["config"],
+        "template": sms_spec["template"],
+        "config_data": sms_configs[sms_spec["config"]],
+        "template_data": sms_templates[sms_spec["template"]],
+        # Routage par préfixe vers la configuration de chaque opérateur
+        "routes": operator_routes(sms_configs, preferred=sms_spec["config"]) if sms_spec.get("auto_route") else None
+    }
+
+def run_campaign(spec, contacts_path, resend_failed=False, progress_interval=1.0, chunk_size=CONTACT_CHUNK_SIZE):
+    """Exécute une campagne sans interface ; retourne le résumé (dictionnaire sérialisable en JSON).
+
+    Le fichier de contacts est lu en flux par morceaux de `chunk_size` lignes :
+    la mémoire utilisée ne dépend pas de la taille de la liste.
+    """
+    smtp_configs, email_templates, _ = load_data()
+    sms_configs, sms_templates = load_sms_configs(), load_sms_templates()
+
+    columns = pd.read_csv(contacts_path, nrows=0).columns
+
+    email_config = build_email_config(spec["email"], smtp_configs, email_templates) if spec.get("email") else None
+    sms_config = build_sms_config(spec["sms"], sms_configs, sms_templates) if spec.get("sms") else None
+
+    # Mapping : colonnes du même nom que la variable détectées automatiquement, comme dans l'interface
+    variables = ()
+    if email_config:
+        template = email_config["template_data"]
+        variables += extract_template_variables(template.get("html") or "", template.get("text") or "", syntax="email")
+    if sms_config:
+        variables += extract_template_variables(sms_config["template_data"].get("content") or "", syntax="sms")
+    var_mapping = {var: var for var in variables if var in columns}
+    var_mapping.update(spec.get("var_mapping") or {})
+    default_values = {var: var for var in variables}
+    default_values.update(spec.get("default_values") or {})
+
+    # Même identifiant que dans l'interface : reprise et renvoi des échecs partagés
+    journal = get_send_journal()
+    campaign_id = make_campaign_id(
+        content_hash(contacts_path),
+        email_config["template"] if email_config else "",
+        sms_config["template"] if sms_config else ""
+    )
+    name = spec.get("name") or f"{os.path.basename(contacts_path)} - {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    channels = [channel for channel, config in (("email", email_config), ("sms", sms_config)) if config]
+    journal.start_campaign(campaign_id, name, channels)
+
+    summary = {
+        "name": name,
+        "campaign_id": campaign_id,
+        "contacts": contacts_path,
+        "started_at": datetime.now().isoformat(),
+        "channels": {}
+    }
+    for channel in channels:
+        config = email_config if channel == "email" else sms_config
+        config["campaign_id"] = campaign_id
+        column = "email" if channel == "email" else "telephone"
+        if column not in columns:
+            print(f"[{channel}] colonne '{column}' absente du fichier, canal ignoré")
+            continue
+        # Premier passage sur la seule colonne du canal pour connaître le nombre d'envois
+        total = sum(len(chunk) for chunk in journal.pending_chunks(
+            iter_channel_contacts(contacts_path, channel, chunk_size, usecols=[column]),
+            column, campaign_id, channel, failed_only=resend_failed
+        ))
+        contacts = journal.pending_chunks(
+            iter_channel_contacts(contacts_path, channel, chunk_size),
+            column, campaign_id, channel, failed_only=resend_failed
+        )
+        progress = ConsoleProgress(channel, interval=progress_interval)
+        started = time.monotonic()
+        if channel == "email":
+            attachment_file = None
+            if spec.get("attachment"):
+                with open(spec["attachment"], "rb") as f:
+                    attachment_file = io.BytesIO(f.read())
+                attachment_file.name = os.path.basename(spec["attachment"])
+            results = send_email_campaign(
+                contacts, config, var_mapping, default_values, attachment_file, progress=progress, total=total
+            )
+        else:
+            results = send_sms_campaign(contacts, config, var_mapping, default_values, progress=progress, total=total)
+        duration = time.monotonic() - started
+        summary["channels"][channel] = {
+            "total": total,
+            "success_count": results["success_count"],
+            "error_count": results["error_count"],
+            "duration_s": round(duration, 3),
+            "per_second": round(total / duration, 2) if duration > 0 else None,
+            "dead_letters": results.get("dead_letters", [])
+        }
+        print(f"[{channel}] terminé : {results['success_count']} envoyé(s), {results['error_count']} erreur(s) en {duration:.1f}s")
+
+    journal.finish_campaign(campaign_id)
+    summary["finished_at"] = datetime.now().isoformat()
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Lance une campagne email/SMS sans l'interface Streamlit",
+        epilog=SPEC_EXAMPLE,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("spec", help="Fichier JSON décrivant la campagne")
+    parser.add_argument("contacts", help="Fichier CSV des contacts")
+    parser.add_argument("--output", default="campaign_summary.json", help="Fichier JSON où écrire le résumé")
+    parser.add_argument("--resend-failed", action="store_true", help="Renvoyer uniquement les échecs de la campagne")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="Secondes entre deux lignes d'avancement")
+    parser.add_argument("--chunk-size", type=int, default=CONTACT_CHUNK_SIZE, help="Lignes du CSV lues à la fois")
+    args = parser.parse_args(argv)
+
+    with open(args.spec, "r") as f:
+        spec = json.load(f)
+    summary = run_campaign(spec, args.contacts, args.resend_failed, args.progress_interval, args.chunk_size)
+
+    with open(args.output, "w") as f:
+        json.dump(summary, f, indent=4, ensure_ascii=False)
+    print(f"📄 Résumé écrit dans {args.output}")
+
+    # Code de sortie non nul si des envois ont échoué (utile pour cron)
+    return 1 if any(channel["error_count"] for channel in summary["channels"].values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
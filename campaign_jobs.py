@@ -0,0 +1,256 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+import pandas as pd
+from send_results import export_campaign_results, import_campaign_results
+
+JOBS_DIR = "campaign_jobs"
+# Intervalle minimal entre deux écritures du statut d'un job (secondes)
+STATUS_INTERVAL = 0.5
+
+def _job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+def _write_json(path, data):
+    # Écriture atomique : l'interface ne lit jamais un fichier à moitié écrit
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+def _read_json(path, default=None):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return default
+
+def create_campaign_job(name, var_mapping, default_values, email_df=None, email_config=None,
+                        sms_df=None, sms_config=None, attachment_file=None, campaign_id=None,
+                        contacts_file=None, failed_only=False, totals=None):
+    """Sérialise une campagne (contacts, templates, mapping, configurations) dans un dossier de job.
+
+    Retourne l'identifiant du job ; le dossier suffit à exécuter la campagne
+    dans un autre processus. Avec `contacts_file` (gros fichiers), le CSV est
+    copié tel quel et relu en flux par le job au lieu des DataFrames par canal ;
+    `totals` donne alors le nombre de contacts attendu par canal.
+    """
+    job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir)
+
+    channels = {}
+    if contacts_file is not None:
+        contacts_file.seek(0)
+        with open(os.path.join(job_dir, "contacts.csv"), "wb") as f:
+            shutil.copyfileobj(contacts_file, f)
+    for channel, df, config in (("email", email_df, email_config), ("sms", sms_df, sms_config)):
+        if config is None:
+            continue
+        if contacts_file is not None:
+            channels[channel] = {
+                "config": config,
+                "contacts": "contacts.csv",
+                "streaming": True,
+                "failed_only": failed_only,
+                "total": (totals or {}).get(channel)
+            }
+            continue
+        if df is None or df.empty:
+            continue
+        # Pickle : les contacts sont relus à l'identique (types, zéros en tête des numéros)
+        contacts = f"contacts_{channel}.pkl"
+        df.to_pickle(os.path.join(job_dir, contacts))
+        channels[channel] = {"config": config, "contacts": contacts, "total": len(df)}
+
+    attachment = None
+    if attachment_file is not None:
+        attachment_file.seek(0)
+        with open(os.path.join(job_dir, "attachment.bin"), "wb") as f:
+            f.write(attachment_file.read())
+        attachment = {"name": attachment_file.name, "path": "attachment.bin"}
+
+    spec = {
+        "id": job_id,
+        "name": name,
+        "campaign_id": campaign_id,
+        "created_at": datetime.now().isoformat(),
+        "var_mapping": var_mapping,
+        "default_values": default_values,
+        "attachment": attachment,
+        "channels": channels
+    }
+    _write_json(os.path.join(job_dir, "spec.json"), spec)
+    _write_json(os.path.join(job_dir, "status.json"), {
+        "id": job_id,
+        "name": name,
+        "state": "queued",
+        "created_at": spec["created_at"],
+        "channels": {
+            channel: {"done": 0, "total": channel_spec["total"], "message": "⏳ En attente..."}
+            for channel, channel_spec in channels.items()
+        }
+    })
+    return job_id
+
+def start_campaign_job(job_id):
+    """Lance l'exécution d'un job dans un processus indépendant de la session Streamlit"""
+    job_dir = _job_dir(job_id)
+    options = {}
+    if os.name == "posix":
+        options["start_new_session"] = True
+    else:
+        options["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+    with open(os.path.join(job_dir, "job.log"), "a") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), job_id],
+            cwd=os.getcwd(), stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+            **options
+        )
+    # Le processus n'est jamais attendu : on le récupère en arrière-plan pour éviter un zombie
+    threading.Thread(target=process.wait, daemon=True).start()
+    return process.pid
+
+def submit_campaign_job(name, var_mapping, default_values, **channels):
+    """Crée puis lance un job de campagne ; retourne son identifiant"""
+    job_id = create_campaign_job(name, var_mapping, default_values, **channels)
+    start_campaign_job(job_id)
+    return job_id
+
+class JobProgress:
+    """Callback d'avancement qui écrit le statut du job (au plus toutes les STATUS_INTERVAL secondes)"""
+
+    def __init__(self, job_dir, status, channel, interval=STATUS_INTERVAL):
+        self.path = os.path.join(job_dir, "status.json")
+        self.status = status
+        self.channel = channel
+        self.interval = interval
+        self._last_write = 0.0
+
+    def __call__(self, done, total, message=None, final=False):
+        channel_status = self.status["channels"][self.channel]
+        channel_status["done"] = done
+        channel_status["total"] = total
+        if message:
+            channel_status["message"] = message
+        now = time.monotonic()
+        if final or now - self._last_write >= self.interval or (total and done >= total):
+            self._last_write = now
+            _write_json(self.path, self.status)
+
+def _load_attachment(job_dir, spec):
+    attachment = spec.get("attachment")
+    if not attachment:
+        return None
+    with open(os.path.join(job_dir, attachment["path"]), "rb") as f:
+        attachment_file = io.BytesIO(f.read())
+    attachment_file.name = attachment["name"]
+    return attachment_file
+
+def run_campaign_job(job_id):
+    """Exécute un job de campagne (point d'entrée du processus lancé par `start_campaign_job`)"""
+    # Import tardif : les moteurs d'envoi ne sont chargés que dans le processus du job
+    from email_sender import send_email_campaign
+    from sms_sender import send_sms_campaign
+    from send_journal import get_send_journal
+    from contact_manager import iter_channel_contacts
+
+    job_dir = _job_dir(job_id)
+    spec = _read_json(os.path.join(job_dir, "spec.json"))
+    status = _read_json(os.path.join(job_dir, "status.json"))
+    status.update({"state": "running", "pid": os.getpid(), "started_at": datetime.now().isoformat()})
+    _write_json(os.path.join(job_dir, "status.json"), status)
+
+    results = {}
+    try:
+        for channel, channel_spec in spec["channels"].items():
+            contacts_path = os.path.join(job_dir, channel_spec["contacts"])
+            if channel_spec.get("streaming"):
+                # Lecture en flux : seuls les contacts restant à envoyer sont gardés, morceau par morceau
+                df = iter_channel_contacts(contacts_path, channel)
+                if spec.get("campaign_id"):
+                    df = get_send_journal().pending_chunks(
+                        df, "email" if channel == "email" else "telephone", spec["campaign_id"], channel,
+                        failed_only=channel_spec.get("failed_only", False)
+                    )
+            else:
+                df = pd.read_pickle(contacts_path)
+            progress = JobProgress(job_dir, status, channel)
+            if channel == "email":
+                results[channel] = send_email_campaign(
+                    df, channel_spec["config"], spec["var_mapping"], spec["default_values"],
+                    _load_attachment(job_dir, spec), progress=progress, total=channel_spec.get("total")
+                )
+            else:
+                results[channel] = send_sms_campaign(
+                    df, channel_spec["config"], spec["var_mapping"], spec["default_values"],
+                    progress=progress, total=channel_spec.get("total")
+                )
+            status["channels"][channel].update({
+                "success_count": results[channel]["success_count"],
+                "error_count": results[channel]["error_count"]
+            })
+        status["state"] = "done"
+    except Exception as e:
+        traceback.print_exc()
+        status["state"] = "failed"
+        status["error"] = str(e)
+    finally:
+        if spec.get("campaign_id"):
+            get_send_journal().finish_campaign(spec["campaign_id"])
+        status["finished_at"] = datetime.now().isoformat()
+        _write_json(os.path.join(job_dir, "results.json"), export_campaign_results(results))
+        _write_json(os.path.join(job_dir, "status.json"), status)
+
+def _is_alive(pid):
+    if not pid or os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def load_job_status(job_id):
+    """Statut courant d'un job ; un job dont le processus a disparu est marqué interrompu"""
+    status = _read_json(os.path.join(_job_dir(job_id), "status.json"))
+    if status and status["state"] == "running" and not _is_alive(status.get("pid")):
+        status["state"] = "interrupted"
+    return status
+
+def load_job_results(job_id):
+    """Résultats d'un job terminé (même format que l'envoi dans la page)"""
+    return import_campaign_results(_read_json(os.path.join(_job_dir(job_id), "results.json"), {}))
+
+def job_results_modified(job_id):
+    """Date de dernière écriture des résultats d'un job (0 s'ils n'existent pas encore)"""
+    path = os.path.join(_job_dir(job_id), "results.json")
+    return os.path.getmtime(path) if os.path.exists(path) else 0
+
+def job_contacts_file(job_id):
+    """CSV des contacts d'un job lu en flux, None si les contacts ont été sérialisés par canal"""
+    path = os.path.join(_job_dir(job_id), "contacts.csv")
+    return path if os.path.exists(path) else None
+
+def list_jobs(limit=10):
+    """Statuts des derniers jobs, du plus récent au plus ancien"""
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    statuses = []
+    for job_id in sorted(os.listdir(JOBS_DIR), reverse=True)[:limit]:
+        status = load_job_status(job_id)
+        if status:
+            statuses.append(status)
+    return statuses
+
+if __name__ == "__main__":
+    run_campaign_job(sys.argv[1])
@@ -1,27 +1,40 @@
+import os
 import streamlit as st
 import pandas as pd
 import re
 from datetime import datetime
 from email_sender import send_email_campaign
-from sms_sender import send_sms_campaign
+from sms_sender import send_sms_campaign, operator_routes
 from data_manager import load_data
 from sms_manager import load_sms_configs, load_sms_templates
+from template_renderer import compile_template, extract_template_variables
+from contact_manager import (
+    CONTACT_COLUMNS, PHONE_COLUMNS, STREAMING_THRESHOLD, resolve_variable_values, channel_contacts,
+    iter_channel_contacts, contact_file_hash, load_contact_file
+)
+from smtp_pool import DEFAULT_MAX_RECIPIENTS
+from rate_limiter import get_quota_store
+from send_journal import STATUS_FAILED, STATUS_SENT, get_send_journal, make_campaign_id
+from campaign_jobs import submit_campaign_job, list_jobs, load_job_results, job_results_modified, job_contacts_file
+from campaign_report import build_status_report, parquet_available
+from log_spool import DOWNLOAD_MAX_BYTES, export_spool, read_download, spool_size
+from campaign_queue import get_campaign_queue
 
-def detect_contact_channels(df):
-    """Détecte automatiquement les canaux disponibles dans le CSV"""
-    channels = {"email": False, "sms": False}
-    
-    if "email" in df.columns and not df["email"].isna().all():
-        channels["email"] = True
-    
-    if "telephone" in df.columns and not df["telephone"].isna().all():
-        # Vérifier qu'il y a des numéros valides
-        from sms_utils import validate_cameroon_phone
-        valid_phones = df["telephone"].dropna().apply(lambda x: validate_cameroon_phone(str(x)))
-        if valid_phones.any():
-            channels["sms"] = True
-    
-    return channels
+# Résultats de jobs gardés en mémoire une fois relus
+JOB_RESULTS_CACHE_ENTRIES = 2
+# Durée de validité des comptes lus dans le journal des envois (secondes)
+JOURNAL_CACHE_TTL = 30
+EXECUTION_MODES = {
+    "page": "📄 Dans la page",
+    "background": "🖥️ En arrière-plan",
+    "queue": "📬 File partagée (workers)"
+}
+
+@st.cache_data(ttl=JOURNAL_CACHE_TTL, show_spinner=False)
+def journal_counts(campaign_id, channels):
+    """Envois réussis et en échec de la campagne par canal, relus au plus toutes les `JOURNAL_CACHE_TTL` secondes"""
+    journal = get_send_journal()
+    return {channel: journal.counts(campaign_id, channel) for channel in channels}
 
 def check_spam_risks(email_content, sms_content):
     """Vérifie les risques de spam dans le contenu"""
@@ -81,24 +94,13 @@ def check_spam_risks(email_content, sms_content):
     
     return warnings
 
-def get_variable_value(var, row, var_mapping, default_values):
-    """Récupère la valeur d'une variable pour une ligne donnée - VERSION CORRIGÉE"""
-    try:
-        if var in var_mapping and var_mapping[var] in row:
-            value = row[var_mapping[var]]
-            # Gérer les valeurs NaN, None ou vides
-            if pd.isna(value) or value is None or str(value).strip() == "":
-                return default_values.get(var, "") or ""  # S'assurer de ne pas retourner None
-            return str(value).strip()
-        else:
-            return default_values.get(var, "") or ""  # S'assurer de ne pas retourner None
-    except Exception as e:
-        # En cas d'erreur, retourner une chaîne vide
-        return default_values.get(var, "") or ""
-
 def campaign_section():
     st.header("🎯 Campagne Marketing Multi-Canal")
     
+    # Campagnes lancées en arrière-plan (rafraîchi automatiquement)
+    campaign_jobs_panel()
+    job_results_panel()
+    
     # Section d'information anti-spam
     with st.expander("📋 Bonnes pratiques anti-spam", expanded=False):
         st.info("""
@@ -144,10 +146,16 @@ def campaign_section():
         st.info("📤 Veuillez importer un fichier CSV pour continuer")
         return
         
-    df = pd.read_csv(uploaded_file)
+    # Gros fichier : seul un premier morceau sert à la détection, au mapping et à l'aperçu
+    streaming = uploaded_file.size > STREAMING_THRESHOLD
+    # Fichier analysé une seule fois par contenu, pas à chaque interaction
+    contact_file = load_contact_file(contact_file_hash(uploaded_file), uploaded_file, streaming)
+    df = contact_file["df"]
+    counts = contact_file["counts"]
+    available_channels = contact_file["channels"]
     
-    # Détection automatique des canaux
-    available_channels = detect_contact_channels(df)
+    if streaming:
+        st.info(f"📦 Fichier volumineux : aperçu sur les {len(df)} premières lignes, les contacts seront lus par morceaux pendant l'envoi")
     
     if not any(available_channels.values()):
         st.error("❌ Aucun canal détecté. Le CSV doit contenir 'email' ou 'telephone'")
@@ -158,23 +166,13 @@ def campaign_section():
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        total_contacts = len(df)
-        st.metric("Total contacts", total_contacts)
+        st.metric("Total contacts", counts["total"])
     
     with col2:
-        if available_channels["email"]:
-            email_count = df["email"].dropna().count()
-            st.metric("📧 Emails", email_count)
-        else:
-            st.metric("📧 Emails", 0)
+        st.metric("📧 Emails", counts["email"])
     
     with col3:
-        if available_channels["sms"]:
-            from sms_utils import validate_cameroon_phone
-            phone_count = df["telephone"].dropna().apply(lambda x: validate_cameroon_phone(str(x))).sum()
-            st.metric("📱 SMS", phone_count)
-        else:
-            st.metric("📱 SMS", 0)
+        st.metric("📱 SMS", counts["sms"])
     
     # Sélection des canaux
     st.subheader("🎯 Canaux à utiliser")
@@ -208,10 +206,12 @@ def campaign_section():
         
         col1, col2 = st.columns(2)
         with col1:
-            selected_smtp = st.selectbox(
-                "Serveur SMTP",
+            selected_smtps = st.multiselect(
+                "Serveurs SMTP",
                 list(smtp_configs.keys()),
-                key="campaign_smtp"
+                default=list(smtp_configs.keys())[:1],
+                key="campaign_smtp",
+                help="Plusieurs comptes : les destinataires sont répartis selon leur poids, avec bascule automatique si un compte tombe"
             )
         with col2:
             selected_email_template = st.selectbox(
@@ -220,11 +220,73 @@ def campaign_section():
                 key="campaign_email_template"
             )
         
+        if not selected_smtps:
+            st.warning("⚠️ Sélectionnez au moins un serveur SMTP")
+            st.stop()
+        
+        # Poids de chaque compte dans la répartition des destinataires
+        smtp_accounts = []
+        if len(selected_smtps) > 1:
+            weight_cols = st.columns(len(selected_smtps))
+            for weight_col, smtp_name in zip(weight_cols, selected_smtps):
+                with weight_col:
+                    weight = st.number_input(
+                        f"Poids {smtp_name}",
+                        min_value=1,
+                        value=int(smtp_configs[smtp_name].get("weight", 1) or 1),
+                        key=f"campaign_smtp_weight_{smtp_name}"
+                    )
+                smtp_accounts.append({"name": smtp_name, "config": smtp_configs[smtp_name], "weight": weight})
+        else:
+            smtp_accounts.append({"name": selected_smtps[0], "config": smtp_configs[selected_smtps[0]]})
+        
+        # Quotas journaliers restants des comptes sélectionnés
+        remaining = [get_quota_store().remaining(account["config"]) for account in smtp_accounts]
+        if all(value is not None for value in remaining):
+            total_remaining = sum(remaining)
+            email_total = counts["email"]
+            if email_total > total_remaining:
+                st.warning(f"⚠️ Quota journalier restant: {total_remaining} envoi(s) pour {email_total} email(s). Les suivants seront en erreur.")
+            else:
+                st.info(f"📊 Quota journalier restant: {total_remaining} envoi(s)")
+        
+        # Envoi groupé pour les messages identiques (newsletters sans personnalisation)
+        batch_col1, batch_col2 = st.columns(2)
+        with batch_col1:
+            batch_identical = st.checkbox(
+                "📦 Regrouper les emails identiques",
+                value=False,
+                key="campaign_batch_identical",
+                help="Un seul envoi SMTP pour plusieurs destinataires recevant exactement le même message (en-tête To neutre)"
+            )
+        with batch_col2:
+            batch_size = st.number_input(
+                "Destinataires par envoi",
+                min_value=1,
+                max_value=500,
+                value=DEFAULT_MAX_RECIPIENTS,
+                key="campaign_batch_size",
+                disabled=not batch_identical
+            )
+        
+        render_processes = st.number_input(
+            "Processus de rendu",
+            min_value=0,
+            max_value=os.cpu_count() or 1,
+            value=0,
+            key="campaign_render_processes",
+            help="Répartit la personnalisation et la construction des emails sur plusieurs cœurs (0 = désactivé). Utile pour les gros templates HTML personnalisés"
+        )
+        
         email_config = {
-            "smtp": selected_smtp,
+            "smtp": ", ".join(selected_smtps),
             "template": selected_email_template,
-            "config_data": smtp_configs[selected_smtp],
-            "template_data": email_templates[selected_email_template]
+            "config_data": smtp_configs[selected_smtps[0]],
+            "template_data": email_templates[selected_email_template],
+            "accounts": smtp_accounts,
+            "batch_identical": batch_identical,
+            "batch_size": int(batch_size),
+            "render_processes": int(render_processes)
         }
         
         # Préparer le contenu pour vérification spam
@@ -253,11 +315,28 @@ def campaign_section():
                 key="campaign_sms_template"
             )
         
+        # Routage : chaque numéro part par la configuration de son opérateur (préfixe)
+        routes = operator_routes(sms_configs, preferred=selected_sms_config)
+        auto_route = st.checkbox(
+            "📡 Router chaque numéro vers son opérateur",
+            value=len(routes) > 1,
+            key="campaign_sms_auto_route",
+            disabled=len(routes) < 2,
+            help="Orange (69x, 655-659) et MTN (650-654, 67x, 68x) reconnus au préfixe : envoi sur le réseau du destinataire, "
+                 "les deux opérateurs en parallèle. Les autres numéros passent par la configuration choisie"
+        )
+        if auto_route and len(routes) > 1:
+            st.caption("Routes : " + ", ".join(
+                f"{operator} → {name}" for name, config in sms_configs.items()
+                for operator, route_config in routes.items() if route_config is config
+            ))
+        
         sms_config = {
             "config": selected_sms_config,
             "template": selected_sms_template,
             "config_data": sms_configs[selected_sms_config],
-            "template_data": sms_templates[selected_sms_template]
+            "template_data": sms_templates[selected_sms_template],
+            "routes": routes if auto_route else None
         }
         
         # Préparer le contenu pour vérification spam
@@ -302,19 +381,18 @@ def campaign_section():
     st.subheader("🔧 Personnalisation des messages")
     
     # Détection des variables communes
-    all_variables = set()
+    email_vars, sms_vars = (), ()
     
     if email_config:
         html_content = email_config["template_data"].get("html") or ""
         text_content = email_config["template_data"].get("text") or ""
-        email_content = html_content + " " + text_content
-        email_vars = set(re.findall(r'\[(.*?)\]', email_content))
-        all_variables.update(email_vars)
+        email_vars = extract_template_variables(html_content, text_content, syntax="email")
     
     if sms_config:
         sms_content = sms_config["template_data"].get("content") or ""
-        sms_vars = set(re.findall(r'\{(.*?)\}', sms_content))
-        all_variables.update(sms_vars)
+        sms_vars = extract_template_variables(sms_content, syntax="sms")
+    
+    all_variables = tuple(dict.fromkeys(email_vars + sms_vars))
     
     # Mapping des variables
     var_mapping, default_values = {}, {}
@@ -329,7 +407,7 @@ def campaign_section():
                     var_mapping[var] = var
                     st.write(f"✔️ `{var}` détecté dans CSV")
                 else:
-                    options = [col for col in df.columns if col not in ['email', 'telephone']]
+                    options = [col for col in df.columns if col not in ['email', 'telephone'] + PHONE_COLUMNS]
                     selected_col = st.selectbox(
                         f"Colonne pour '{var}'", 
                         ["(Ignorer)"] + options, 
@@ -353,20 +431,18 @@ def campaign_section():
     st.subheader("👀 Aperçu des messages")
     
     if not df.empty:
-        preview_row = df.iloc[0]
+        # Même préparation des valeurs que pour l'envoi
+        values = resolve_variable_values(df.iloc[:1], all_variables, var_mapping, default_values, fallback="")[0]
         
         # Aperçu Email
         if selected_channels.get("email") and email_config:
             with st.expander("📧 Aperçu Email", expanded=True):
-                preview_html = email_config["template_data"].get("html") or ""
-                preview_text = email_config["template_data"].get("text") or ""
-                
-                for var in all_variables:
-                    value = get_variable_value(var, preview_row, var_mapping, default_values)
-                    # S'assurer que la valeur n'est pas None avant de remplacer
-                    safe_value = str(value) if value is not None else ""
-                    preview_html = preview_html.replace(f"[{var}]", safe_value)
-                    preview_text = preview_text.replace(f"[{var}]", safe_value)
+                preview_html = compile_template(
+                    email_config["template_data"].get("html") or "", "email", all_variables
+                ).render(values)
+                preview_text = compile_template(
+                    email_config["template_data"].get("text") or "", "email", all_variables
+                ).render(values)
                 
                 if preview_html.strip():
                     st.components.v1.html(preview_html, height=300, scrolling=True)
@@ -376,13 +452,9 @@ def campaign_section():
         # Aperçu SMS
         if selected_channels.get("sms") and sms_config:
             with st.expander("📱 Aperçu SMS", expanded=True):
-                preview_sms = sms_config["template_data"].get("content") or ""
-                
-                for var in all_variables:
-                    value = get_variable_value(var, preview_row, var_mapping, default_values)
-                    # S'assurer que la valeur n'est pas None avant de remplacer
-                    safe_value = str(value) if value is not None else ""
-                    preview_sms = preview_sms.replace(f"{{{var}}}", safe_value)
+                preview_sms = compile_template(
+                    sms_config["template_data"].get("content") or "", "sms", all_variables
+                ).render(values)
                 
                 st.text_area("Message SMS", preview_sms, height=100)
                 char_count = len(preview_sms)
@@ -408,12 +480,9 @@ def campaign_section():
     with summary_cols[1]:
         st.write("**Portée:**")
         if selected_channels.get("email"):
-            email_count = df["email"].dropna().count()
-            st.write(f"📧 {email_count} emails")
+            st.write(f"📧 {counts['email']} emails")
         if selected_channels.get("sms"):
-            from sms_utils import validate_cameroon_phone
-            sms_count = df["telephone"].dropna().apply(lambda x: validate_cameroon_phone(str(x))).sum()
-            st.write(f"📱 {sms_count} SMS")
+            st.write(f"📱 {counts['sms']} SMS")
     
     with summary_cols[2]:
         st.write("**Configuration:**")
@@ -429,8 +498,42 @@ def campaign_section():
         Assurez-vous d'avoir le consentement des destinataires et respectez les lois anti-spam.
         """)
     
-    # Bouton de lancement
-    if st.button("🎯 Démarrer la campagne multi-canal", type="primary", use_container_width=True):
+    # Journal des envois : même fichier et mêmes templates => même campagne
+    journal = get_send_journal()
+    campaign_id = make_campaign_id(
+        contact_file_hash(uploaded_file),
+        email_config["template"] if email_config else "",
+        sms_config["template"] if sms_config else ""
+    )
+    channels = [channel for channel, selected in selected_channels.items() if selected]
+    journal_stats = journal_counts(campaign_id, tuple(channels))
+    has_failed = any(count[STATUS_FAILED] for count in journal_stats.values())
+    
+    if has_failed or any(count[STATUS_SENT] for count in journal_stats.values()):
+        st.info(
+            "🔁 **Campagne déjà lancée avec ce fichier :** "
+            + ", ".join(f"{channel}: {journal_stats[channel][STATUS_SENT]} envoyé(s), {journal_stats[channel][STATUS_FAILED]} échec(s)" for channel in channels)
+            + ". Les destinataires déjà atteints ne recevront pas de doublon."
+        )
+    
+    execution_mode = st.radio(
+        "Exécution",
+        list(EXECUTION_MODES.keys()),
+        index=1,
+        format_func=EXECUTION_MODES.get,
+        key="campaign_execution_mode",
+        horizontal=True,
+        help="Arrière-plan : processus séparé, la campagne continue si l'onglet est fermé. "
+             "File partagée : la campagne est découpée en lots traités par les workers (`campaign_worker.py`) d'un ou plusieurs hôtes"
+    )
+    
+    # Boutons de lancement
+    start_clicked = st.button("🎯 Démarrer la campagne multi-canal", type="primary", use_container_width=True)
+    resend_failed = False
+    if has_failed:
+        resend_failed = st.button("🔁 Renvoyer uniquement les échecs", use_container_width=True)
+    
+    if start_clicked or resend_failed:
         # Vérification de sécurité finale
         if has_spam_warnings and not any("🚨" in warning for warnings in spam_warnings.values() for warning in warnings):
             st.warning("⏳ Lancement de la campagne avec risques modérés...")
@@ -441,57 +544,175 @@ def campaign_section():
         
         campaign_results = {}
         
-        # Filtrer les données pour chaque canal
-        email_df = df[df["email"].notna()] if selected_channels.get("email") else pd.DataFrame()
-        sms_df = df[df["telephone"].notna()] if selected_channels.get("sms") else pd.DataFrame()
+        # Filtrer les données pour chaque canal. Reprise : le journal indique qui a déjà
+        # été atteint (ou, en renvoi des échecs, qui doit l'être)
+        pending, totals = {}, {}
+        for channel in channels:
+            column = CONTACT_COLUMNS[channel]
+            if streaming:
+                # Premier passage sur la seule colonne du canal pour compter les envois restants
+                totals[channel] = sum(len(chunk) for chunk in journal.pending_chunks(
+                    iter_channel_contacts(uploaded_file, channel, usecols=[column]),
+                    column, campaign_id, channel, failed_only=resend_failed
+                ))
+                pending[channel] = journal.pending_chunks(
+                    iter_channel_contacts(uploaded_file, channel),
+                    column, campaign_id, channel, failed_only=resend_failed
+                )
+            else:
+                pending[channel] = journal.pending_contacts(
+                    contact_file["contacts"][channel], column, campaign_id, channel, failed_only=resend_failed
+                )
+                totals[channel] = len(pending[channel])
         
-        # Nettoyer les données SMS
-        if selected_channels.get("sms"):
-            from sms_utils import validate_cameroon_phone, format_cameroon_phone
-            sms_df = sms_df[sms_df["telephone"].apply(lambda x: validate_cameroon_phone(str(x)))]
-            sms_df["telephone"] = sms_df["telephone"].apply(lambda x: format_cameroon_phone(str(x)))
+        campaign_name = f"{uploaded_file.name} - {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+        journal.start_campaign(campaign_id, campaign_name, channels)
+        journal_counts.clear()
+        if email_config:
+            email_config["campaign_id"] = campaign_id
+        if sms_config:
+            sms_config["campaign_id"] = campaign_id
+        
+        if execution_mode == "queue":
+            # Les workers prennent les lots et enregistrent leurs résultats dans le même journal
+            batch_count = get_campaign_queue().enqueue(
+                campaign_id, campaign_name, var_mapping, default_values,
+                {channel: (pending[channel], email_config if channel == "email" else sms_config) for channel in channels}
+            )
+            st.success(f"📬 Campagne déposée dans la file partagée ({batch_count} lot(s)). Les workers vont la traiter.")
+            return
+        
+        if execution_mode == "background":
+            # La page ne fait que soumettre le job ; le suivi se fait dans le panneau en haut de page
+            # Gros fichier : le job reçoit le CSV tel quel et le relit en flux
+            job_id = submit_campaign_job(
+                campaign_name, var_mapping, default_values,
+                email_df=None if streaming else pending.get("email"),
+                email_config=email_config if selected_channels.get("email") else None,
+                sms_df=None if streaming else pending.get("sms"),
+                sms_config=sms_config if selected_channels.get("sms") else None,
+                campaign_id=campaign_id,
+                contacts_file=uploaded_file if streaming else None,
+                failed_only=resend_failed,
+                totals=totals
+            )
+            st.success(f"🚀 Campagne lancée en arrière-plan (job {job_id}). Vous pouvez fermer cet onglet.")
+            return
         
         # Lancement parallèle des campagnes
         progress_placeholder = st.empty()
         results_placeholder = st.empty()
         
         # Email Campaign
-        if selected_channels.get("email") and not email_df.empty:
+        if selected_channels.get("email") and totals.get("email"):
             with st.spinner("📧 Envoi des emails en cours..."):
                 try:
                     email_results = send_email_campaign(
-                        email_df, email_config, var_mapping, default_values
+                        pending["email"], email_config, var_mapping, default_values, total=totals["email"]
                     )
                     campaign_results["email"] = email_results
                 except Exception as e:
                     st.error(f"❌ Erreur lors de l'envoi des emails: {str(e)}")
                     campaign_results["email"] = {
                         "success_count": 0,
-                        "error_count": len(email_df),
+                        "error_count": totals["email"],
                         "logs": [f"Erreur globale: {str(e)}"]
                     }
         
         # SMS Campaign  
-        if selected_channels.get("sms") and not sms_df.empty:
+        if selected_channels.get("sms") and totals.get("sms"):
             with st.spinner("📱 Envoi des SMS en cours..."):
                 try:
                     sms_results = send_sms_campaign(
-                        sms_df, sms_config, var_mapping, default_values
+                        pending["sms"], sms_config, var_mapping, default_values, total=totals["sms"]
                     )
                     campaign_results["sms"] = sms_results
                 except Exception as e:
                     st.error(f"❌ Erreur lors de l'envoi des SMS: {str(e)}")
                     campaign_results["sms"] = {
                         "success_count": 0,
-                        "error_count": len(sms_df),
+                        "error_count": totals["sms"],
                         "logs": [f"Erreur globale: {str(e)}"]
                     }
         
+        journal.finish_campaign(campaign_id)
+        journal_counts.clear()
+        
         # Affichage des résultats finaux
-        display_campaign_results(campaign_results)
+        display_campaign_results(campaign_results, contacts_file=uploaded_file)
+
+JOB_STATES = {
+    "queued": "⏳ En attente",
+    "running": "🔄 En cours",
+    "done": "✅ Terminée",
+    "failed": "❌ Échec",
+    "interrupted": "⚠️ Interrompue"
+}
+
+@st.fragment(run_every=2)
+def campaign_jobs_panel():
+    """Suivi des campagnes exécutées en arrière-plan"""
+    queued_campaigns_panel()
+    
+    jobs = list_jobs(limit=5)
+    if not jobs:
+        return
+    
+    with st.expander("🖥️ Campagnes en arrière-plan", expanded=any(job["state"] in ("queued", "running") for job in jobs)):
+        for job in jobs:
+            st.write(f"**{job['name']}** — {JOB_STATES.get(job['state'], job['state'])}")
+            for channel, channel_status in job["channels"].items():
+                total = channel_status.get("total") or 0
+                done = channel_status.get("done", 0)
+                st.progress(
+                    min(done / total, 1.0) if total else 0.0,
+                    text=f"{'📧' if channel == 'email' else '📱'} {done}/{total} — {channel_status.get('message', '')}"
+                )
+            if job.get("error"):
+                st.error(job["error"])
+
+@st.cache_resource(max_entries=JOB_RESULTS_CACHE_ENTRIES)
+def cached_job_results(job_id, modified):
+    """Résultats d'un job, relus seulement quand son fichier de résultats change (`modified`)"""
+    return load_job_results(job_id)
+
+def job_results_panel():
+    """Résultats d'un job terminé, hors du panneau rafraîchi toutes les 2 secondes"""
+    finished = [job["id"] for job in list_jobs(limit=5) if job["state"] in ("done", "failed", "interrupted")]
+    if not finished:
+        return
+    selected_job = st.selectbox("Résultats du job", ["(Aucun)"] + finished, key="campaign_job_results")
+    if selected_job != "(Aucun)":
+        display_campaign_results(
+            cached_job_results(selected_job, job_results_modified(selected_job)),
+            contacts_file=job_contacts_file(selected_job)
+        )
+
+def queued_campaigns_panel():
+    """Avancement des campagnes déposées dans la file partagée des workers"""
+    campaigns = get_campaign_queue().campaigns(limit=5)
+    if not campaigns:
+        return
+    
+    active = any(campaign["queued"] or campaign["leased"] for campaign in campaigns)
+    with st.expander("📬 Campagnes de la file partagée", expanded=active):
+        for campaign in campaigns:
+            batches = sum(campaign[state] for state in ("queued", "leased", "done", "failed"))
+            finished = campaign["done"] + campaign["failed"]
+            st.progress(
+                finished / batches if batches else 0.0,
+                text=f"**{campaign['name']}** — {finished}/{batches} lot(s), {campaign['leased']} en cours "
+                     f"({campaign['workers']} worker(s)) — ✅ {campaign['success_count']} ❌ {campaign['error_count']}"
+            )
+            if campaign["failed"]:
+                st.error(f"❌ {campaign['failed']} lot(s) abandonné(s) après plusieurs tentatives")
+
+def display_campaign_results(campaign_results, contacts_file=None):
+    """Affiche les résultats de la campagne multi-canal.
 
-def display_campaign_results(campaign_results):
-    """Affiche les résultats de la campagne multi-canal"""
+    Les téléchargements sont produits au clic depuis le log de la campagne sur
+    disque ; le rapport par destinataire est joint à `contacts_file` si fourni.
+    """
     st.markdown("---")
     st.header("📊 Résultats de la campagne")
     
@@ -529,10 +750,27 @@ def display_campaign_results(campaign_results):
                     height=150
                 )
                 
+                log_path = results.get("log_path")
+                if log_path and os.path.exists(log_path):
+                    download_campaign_logs(channel, log_path, contacts_file)
+                else:
+                    # Logs complets fabriqués seulement au clic
+                    st.download_button(
+                        f"📥 Télécharger tous les logs {channel}",
+                        lambda logs=results['logs']: "\n".join(logs),
+                        file_name=f"logs_{channel}_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
+                    )
+            
+            if results.get('dead_letters'):
+                # Échecs définitifs : à corriger avant un nouvel envoi
+                dead_df = pd.DataFrame(results['dead_letters'])
+                st.warning(f"⚠️ {len(dead_df)} échec(s) définitif(s) {channel}")
+                st.dataframe(dead_df, use_container_width=True)
                 st.download_button(
-                    f"📥 Télécharger tous les logs {channel}",
-                    "\n".join(results['logs']),
-                    file_name=f"logs_{channel}_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
+                    f"📥 Télécharger les échecs définitifs {channel}",
+                    dead_df.to_csv(index=False),
+                    file_name=f"echecs_{channel}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                    mime="text/csv"
                 )
     
     # Recommandations post-campagne
@@ -552,4 +790,76 @@ def display_campaign_results(campaign_results):
         • Pensez à segmenter votre audience pour de meilleurs résultats
         • Analysez les taux d'ouverture et de conversion
         • Planifiez votre prochaine communication
-        """)
\ No newline at end of file
+        """)
+
+def download_campaign_logs(channel, log_path, contacts_file=None):
+    """Boutons de téléchargement du log (JSONL, brut ou gzip) et du rapport par destinataire.
+
+    Les fichiers sont produits sur disque au clic puis servis tels quels ;
+    un log brut trop volumineux pour la page reste disponible sur le serveur.
+    """
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+    columns = st.columns(4 if parquet_available() else 3)
+    with columns[0]:
+        size = spool_size(log_path)
+        if size <= DOWNLOAD_MAX_BYTES:
+            st.download_button(
+                "📥 Log (JSONL)",
+                lambda: read_download(export_spool(log_path)),
+                file_name=f"logs_{channel}_{stamp}.jsonl",
+                mime="application/jsonl",
+                on_click="ignore",
+                key=f"log_{log_path}"
+            )
+        else:
+            st.caption(f"📁 Log brut ({size // (1024 * 1024)} Mo) sur le serveur : `{os.path.abspath(log_path)}`")
+    with columns[1]:
+        st.download_button(
+            "📥 Log compressé (gzip)",
+            lambda: read_download(export_spool(log_path, compress=True)),
+            file_name=f"logs_{channel}_{stamp}.jsonl.gz",
+            mime="application/gzip",
+            on_click="ignore",
+            key=f"log_gz_{log_path}"
+        )
+    with columns[2]:
+        st.download_button(
+            "📊 Rapport CSV (gzip)",
+            lambda: read_download(build_status_report(log_path, channel, contacts_file, fmt="csv")),
+            file_name=f"rapport_{channel}_{stamp}.csv.gz",
+            mime="application/gzip",
+            on_click="ignore",
+            key=f"report_csv_{log_path}",
+            help="Une ligne par contact du fichier importé, avec statut, code de réponse, latence et erreur"
+        )
+    if parquet_available():
+        with columns[3]:
+            st.download_button(
+                "📊 Rapport Parquet",
+                lambda: read_download(build_status_report(log_path, channel, contacts_file, fmt="parquet")),
+                file_name=f"rapport_{channel}_{stamp}.parquet",
+                mime="application/octet-stream",
+                on_click="ignore",
+                key=f"report_parquet_{log_path}"
+            )
+
+def history_section():
+    """Historique des campagnes à partir du journal des envois"""
+    st.header("📊 Historique des campagnes")
+    
+    campaigns = get_send_journal().campaigns()
+    if not campaigns:
+        st.info("Aucune campagne enregistrée pour le moment.")
+        return
+    
+    history_df = pd.DataFrame(campaigns).rename(columns={
+        "name": "Campagne",
+        "channels": "Canaux",
+        "created_at": "Lancée le",
+        "finished_at": "Terminée le",
+        "sent": "Envoyés",
+        "failed": "Échecs"
+    })
+    history_df["Terminée le"] = history_df["Terminée le"].fillna("⏳ interrompue ou en cours")
+    st.dataframe(history_df.drop(columns=["id"]), use_container_width=True)
+    st.caption("💡 Pour reprendre une campagne ou renvoyer ses échecs, réimportez le même fichier dans 'Campagne Multi-Canal'.")
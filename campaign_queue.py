@@ -0,0 +1,223 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import streamlit as st
+from contact_manager import iter_contact_chunks
+
+# Base partagée par l'interface et les workers (chemin commun à tous les hôtes)
+QUEUE_PATH = os.environ.get("CAMPAIGN_QUEUE_PATH", "campaign_queue.db")
+# Contacts par lot confié à un worker
+QUEUE_BATCH_SIZE = 500
+# Durée d'un bail (secondes) : sans renouvellement, le lot repasse à un autre worker
+LEASE_DURATION = 120
+# Nombre de prises d'un même lot au-delà duquel il est abandonné (worker qui plante à chaque fois)
+MAX_LEASES = 3
+
+BATCH_STATES = ("queued", "leased", "done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queued_campaigns (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    spec TEXT NOT NULL,
+    attachment_name TEXT,
+    attachment BLOB,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    contacts BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_expires REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    success_count INTEGER,
+    error_count INTEGER,
+    error TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS batches_state ON batches (state, lease_expires);
+CREATE INDEX IF NOT EXISTS batches_campaign ON batches (campaign_id, state);
+"""
+
+def _split(contacts, size):
+    """Lots d'au plus `size` contacts, depuis un DataFrame ou des morceaux lus en flux"""
+    for chunk in iter_contact_chunks(contacts):
+        for start in range(0, len(chunk), size):
+            yield chunk.iloc[start:start + size]
+
+class CampaignQueue:
+    """File durable de lots de contacts partagée par plusieurs workers d'envoi (SQLite).
+
+    L'interface dépose une campagne découpée en lots ; chaque worker (un ou
+    plusieurs par hôte, voir `campaign_worker.py`) prend un lot avec un bail
+    qu'il renouvelle pendant l'envoi, puis l'acquitte. Le bail d'un worker
+    arrêté ou planté expire et le lot est repris par un autre ; les
+    destinataires déjà atteints sont alors sautés grâce au journal des envois.
+
+    SQLite sert ici de file de démonstration : entre plusieurs hôtes, la base
+    doit être sur un volume partagé qui respecte les verrous de fichiers.
+    """
+
+    def __init__(self, path=QUEUE_PATH, lease_duration=LEASE_DURATION, max_leases=MAX_LEASES):
+        self.path = path
+        self.lease_duration = lease_duration
+        self.max_leases = max_leases
+        # Transactions explicites (BEGIN IMMEDIATE) : une prise de bail est atomique entre processus
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def enqueue(self, campaign_id, name, var_mapping, default_values, channels, attachment_file=None,
+                batch_size=QUEUE_BATCH_SIZE):
+        """Dépose une campagne : `channels` associe chaque canal à (contacts, configuration).
+
+        Les contacts peuvent être un DataFrame ou des morceaux lus en flux.
+        Retourne le nombre de lots créés.
+        """
+        spec = {
+            "var_mapping": var_mapping,
+            "default_values": default_values,
+            "channels": {channel: config for channel, (_, config) in channels.items()}
+        }
+        attachment_name, attachment = None, None
+        if attachment_file is not None:
+            attachment_file.seek(0)
+            attachment_name, attachment = attachment_file.name, attachment_file.read()
+
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO queued_campaigns (id, name, spec, attachment_name, attachment, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (campaign_id, name, json.dumps(spec), attachment_name, attachment, datetime.now().isoformat())
+                )
+                for channel, (contacts, _) in channels.items():
+                    for batch in _split(contacts, batch_size):
+                        # Pickle : les contacts sont relus à l'identique (types, zéros en tête des numéros)
+                        self._conn.execute(
+                            "INSERT INTO batches (campaign_id, channel, contacts, size) VALUES (?, ?, ?, ?)",
+                            (campaign_id, channel, pickle.dumps(batch), len(batch))
+                        )
+                        count += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def lease(self, worker):
+        """Prend le plus ancien lot disponible (ou dont le bail a expiré) ; None si la file est vide"""
+        with self._lock:
+            while True:
+                now = time.time()
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute(
+                        "SELECT id, campaign_id, channel, contacts, leases FROM batches "
+                        "WHERE state = 'queued' OR (state = 'leased' AND lease_expires < ?) "
+                        "ORDER BY id LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        return None
+                    batch_id, campaign_id, channel, contacts, leases = row
+                    if leases >= self.max_leases:
+                        self._conn.execute(
+                            "UPDATE batches SET state = 'failed', error = ? || COALESCE(' : ' || error, ''), "
+                            "finished_at = ? WHERE id = ?",
+                            (f"abandonné après {leases} tentative(s)", datetime.now().isoformat(), batch_id)
+                        )
+                        self._conn.execute("COMMIT")
+                        continue
+                    self._conn.execute(
+                        "UPDATE batches SET state = 'leased', worker = ?, lease_expires = ?, leases = leases + 1 "
+                        "WHERE id = ?",
+                        (worker, now + self.lease_duration, batch_id)
+                    )
+                    campaign = self._conn.execute(
+                        "SELECT name, spec, attachment_name, attachment FROM queued_campaigns WHERE id = ?",
+                        (campaign_id,)
+                    ).fetchone()
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                name, spec, attachment_name, attachment = campaign
+                return {
+                    "id": batch_id,
+                    "campaign_id": campaign_id,
+                    "name": name,
+                    "channel": channel,
+                    "contacts": pickle.loads(contacts),
+                    "spec": json.loads(spec),
+                    "attachment_name": attachment_name,
+                    "attachment": attachment
+                }
+
+    def renew(self, batch_id, worker):
+        """Prolonge le bail ; False si le lot a été repris par un autre worker"""
+        return self._update(
+            "UPDATE batches SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + self.lease_duration, batch_id, worker)
+        )
+
+    def ack(self, batch_id, worker, success_count, error_count):
+        """Acquitte un lot envoyé ; False si le bail avait expiré entre-temps"""
+        return self._update(
+            "UPDATE batches SET state = 'done', success_count = ?, error_count = ?, finished_at = ? "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (success_count, error_count, datetime.now().isoformat(), batch_id, worker)
+        )
+
+    def release(self, batch_id, worker, error):
+        """Rend un lot dont l'envoi a échoué : il sera repris (dans la limite de `max_leases`)"""
+        return self._update(
+            "UPDATE batches SET state = 'queued', worker = NULL, lease_expires = NULL, error = ? "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (error, batch_id, worker)
+        )
+
+    def _update(self, query, params):
+        with self._lock:
+            return self._conn.execute(query, params).rowcount == 1
+
+    def remaining(self, campaign_id):
+        """Lots de la campagne pas encore terminés (en attente ou en cours)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM batches WHERE campaign_id = ? AND state IN ('queued', 'leased')",
+                (campaign_id,)
+            ).fetchone()
+        return row[0]
+
+    def campaigns(self, limit=10):
+        """Avancement des dernières campagnes déposées (lots et contacts par état)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.id, c.name, c.created_at, "
+                + ", ".join(f"COALESCE(SUM(b.state = '{state}'), 0)" for state in BATCH_STATES)
+                + ", COALESCE(SUM(b.size), 0), COALESCE(SUM(b.success_count), 0), COALESCE(SUM(b.error_count), 0), "
+                "COUNT(DISTINCT b.worker) "
+                "FROM queued_campaigns c LEFT JOIN batches b ON b.campaign_id = c.id "
+                "GROUP BY c.id ORDER BY c.created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        keys = ("id", "name", "created_at") + BATCH_STATES + ("contacts", "success_count", "error_count", "workers")
+        return [dict(zip(keys, row)) for row in rows]
+
+@st.cache_resource
+def get_campaign_queue():
+    """File partagée par tout le processus (interface ou worker)"""
+    return CampaignQueue()
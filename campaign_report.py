@@ -0,0 +1,104 @@
+import gzip
+import importlib.util
+import sqlite3
+import pandas as pd
+from contact_manager import CONTACT_CHUNK_SIZE, iter_channel_contacts
+from log_spool import iter_spool, write_file
+
+REPORT_COLUMNS = ["statut", "code", "latence_ms", "erreur", "horodatage"]
+REPORT_TYPES = {"statut": "string", "code": "Int64", "latence_ms": "float64", "erreur": "string", "horodatage": "string"}
+REPORT_SUFFIXES = {"csv": "csv.gz", "parquet": "parquet"}
+
+def parquet_available():
+    """Le format Parquet demande pyarrow (facultatif), qui l'écrit morceau par morceau"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+def report_path(log_path, fmt="csv"):
+    """Fichier du rapport d'une campagne, à côté de son log"""
+    base = log_path[:-len(".jsonl")] if log_path.endswith(".jsonl") else log_path
+    return f"{base}_rapport.{REPORT_SUFFIXES[fmt]}"
+
+def load_statuses(log_path):
+    """Dernier statut de chaque destinataire d'après le log de la campagne, dans une table SQLite temporaire.
+
+    La base est un fichier temporaire supprimé à la fermeture de la connexion :
+    la mémoire ne dépend pas du nombre de destinataires.
+    """
+    conn = sqlite3.connect("")
+    conn.execute(f"CREATE TABLE statuses (recipient TEXT PRIMARY KEY, {', '.join(REPORT_COLUMNS)})")
+    conn.execute("CREATE TABLE chunk_keys (position INTEGER PRIMARY KEY, recipient TEXT)")
+    # Lecture du log en flux ; une entrée plus récente remplace la précédente
+    conn.executemany(
+        "INSERT INTO statuses VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (recipient) DO UPDATE SET "
+        + ", ".join(f"{name} = excluded.{name}" for name in REPORT_COLUMNS),
+        (
+            (entry["recipient"], entry["status"], entry.get("code"), entry.get("latency_ms"), entry.get("error"), entry["ts"])
+            for entry in iter_spool(log_path) if "recipient" in entry
+        )
+    )
+    return conn
+
+def _report_chunks(statuses, channel, contacts_source, chunksize):
+    column = "email" if channel == "email" else "telephone"
+    if contacts_source is None:
+        for chunk in pd.read_sql_query(
+            f"SELECT recipient AS {column}, {', '.join(REPORT_COLUMNS)} FROM statuses ORDER BY rowid",
+            statuses, chunksize=chunksize
+        ):
+            yield chunk.astype(REPORT_TYPES)
+        return
+    # Contacts relus en flux et complétés par le statut de leur envoi
+    for chunk in iter_channel_contacts(contacts_source, channel, chunksize):
+        statuses.execute("DELETE FROM chunk_keys")
+        statuses.executemany(
+            "INSERT INTO chunk_keys VALUES (?, ?)", enumerate(chunk[column].astype(str).str.strip())
+        )
+        found = pd.read_sql_query(
+            f"SELECT {', '.join('s.' + name for name in REPORT_COLUMNS)} FROM chunk_keys k "
+            "LEFT JOIN statuses s ON s.recipient = k.recipient ORDER BY k.position",
+            statuses
+        )
+        yield pd.concat([chunk.reset_index(drop=True), found.astype(REPORT_TYPES)], axis=1)
+
+def _stable_types(chunk):
+    """Types identiques d'un morceau à l'autre (colonnes de contacts en texte) pour un schéma Parquet unique"""
+    return chunk.astype({
+        column: REPORT_TYPES.get(column, "string") for column in chunk.columns
+    })
+
+def _write_csv(chunks, f):
+    with gzip.GzipFile(fileobj=f, mode="wb") as target:
+        for position, chunk in enumerate(chunks):
+            target.write(chunk.to_csv(index=False, header=position == 0).encode("utf-8"))
+
+def _write_parquet(chunks, f):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(_stable_types(chunk), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(f, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(pd.DataFrame(columns=REPORT_COLUMNS).astype(REPORT_TYPES)), f)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def build_status_report(log_path, channel, contacts_source=None, fmt="csv", chunksize=CONTACT_CHUNK_SIZE):
+    """Rapport par destinataire écrit sur disque : colonnes du fichier de contacts + statut, code, latence, erreur.
+
+    `fmt` vaut "csv" (compressé en gzip) ou "parquet". Sans `contacts_source`,
+    le rapport ne contient que les destinataires présents dans le log.
+    Les contacts sont écrits morceau par morceau ; retourne le chemin du fichier.
+    """
+    statuses = load_statuses(log_path)
+    try:
+        chunks = _report_chunks(statuses, channel, contacts_source, chunksize)
+        write = _write_parquet if fmt == "parquet" else _write_csv
+        return write_file(report_path(log_path, fmt), lambda f: write(chunks, f))
+    finally:
+        statuses.close()
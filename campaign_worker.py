@@ -0,0 +1,113 @@
+import argparse
+import io
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+# Intervalle d'attente quand la file est vide (secondes)
+POLL_INTERVAL = 5.0
+
+def _load_attachment(batch):
+    if not batch["attachment_name"]:
+        return None
+    attachment_file = io.BytesIO(batch["attachment"])
+    attachment_file.name = batch["attachment_name"]
+    return attachment_file
+
+def _keep_lease(queue, batch_id, worker_id, stop):
+    """Renouvelle le bail du lot tant que son envoi n'est pas terminé"""
+    while not stop.wait(queue.lease_duration / 3):
+        if not queue.renew(batch_id, worker_id):
+            # Lot repris ailleurs : le journal évite les doublons pour les destinataires déjà atteints
+            print(f"⚠️ Bail du lot {batch_id} perdu")
+            return
+
+def process_batch(queue, batch, worker_id):
+    """Envoie un lot de la file partagée puis l'acquitte ; retourne les résultats d'envoi"""
+    from email_sender import send_email_campaign
+    from sms_sender import send_sms_campaign
+    from send_journal import get_send_journal
+    from progress_reporter import ConsoleProgress
+
+    channel = batch["channel"]
+    spec = batch["spec"]
+    # Un log par worker : un fichier tournant ne se partage pas entre processus
+    config = dict(
+        spec["channels"][channel], campaign_id=batch["campaign_id"],
+        log_name=f"{batch['campaign_id']}_{worker_id}"
+    )
+    column = "email" if channel == "email" else "telephone"
+    journal = get_send_journal()
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_keep_lease, args=(queue, batch["id"], worker_id, stop), daemon=True)
+    heartbeat.start()
+    try:
+        # Lot repris après un worker arrêté : seuls les destinataires pas encore atteints
+        contacts = journal.pending_contacts(batch["contacts"], column, batch["campaign_id"], channel)
+        progress = ConsoleProgress(f"{channel} lot {batch['id']}")
+        if contacts.empty:
+            results = {"success_count": 0, "error_count": 0, "logs": []}
+        elif channel == "email":
+            results = send_email_campaign(
+                contacts, config, spec["var_mapping"], spec["default_values"], _load_attachment(batch),
+                progress=progress
+            )
+        else:
+            results = send_sms_campaign(contacts, config, spec["var_mapping"], spec["default_values"], progress=progress)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    queue.ack(batch["id"], worker_id, results["success_count"], results["error_count"])
+    if queue.remaining(batch["campaign_id"]) == 0:
+        journal.finish_campaign(batch["campaign_id"])
+    return results
+
+def run_worker(worker_id, once=False, poll_interval=POLL_INTERVAL):
+    """Boucle d'un worker : prend, envoie et acquitte les lots de la file partagée"""
+    from campaign_queue import get_campaign_queue
+
+    queue = get_campaign_queue()
+    print(f"🖥️ Worker {worker_id} à l'écoute de {queue.path}")
+    while True:
+        batch = queue.lease(worker_id)
+        if batch is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        print(f"📦 Lot {batch['id']} ({batch['channel']}, {len(batch['contacts'])} contact(s)) de « {batch['name']} »")
+        try:
+            results = process_batch(queue, batch, worker_id)
+            print(f"✅ Lot {batch['id']} : {results['success_count']} envoyé(s), {results['error_count']} erreur(s)")
+        except Exception as e:
+            traceback.print_exc()
+            queue.release(batch["id"], worker_id, str(e))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker d'envoi qui traite les campagnes déposées dans la file partagée")
+    parser.add_argument("--queue", help="Base SQLite de la file partagée (CAMPAIGN_QUEUE_PATH)")
+    parser.add_argument("--journal", help="Base SQLite du journal des envois partagé (SEND_JOURNAL_PATH)")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}", help="Identifiant du worker")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="Secondes d'attente quand la file est vide")
+    parser.add_argument("--once", action="store_true", help="S'arrêter dès que la file est vide")
+    args = parser.parse_args(argv)
+
+    # Chemins partagés fixés avant le chargement des modules qui les lisent
+    if args.queue:
+        os.environ["CAMPAIGN_QUEUE_PATH"] = args.queue
+    if args.journal:
+        os.environ["SEND_JOURNAL_PATH"] = args.journal
+    try:
+        run_worker(args.worker_id, args.once, args.poll_interval)
+    except KeyboardInterrupt:
+        # Le lot en cours sera repris par un autre worker à l'expiration de son bail
+        print(f"🛑 Worker {args.worker_id} arrêté")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import streamlit as st
+import pandas as pd
+from sms_utils import normalize_cameroon_phones
+from send_journal import content_hash
+
+# Nombre de lignes lues à la fois en lecture en flux
+CONTACT_CHUNK_SIZE = 50000
+# Au-delà de cette taille, le CSV n'est pas chargé en entier : il est relu en flux à l'envoi
+STREAMING_THRESHOLD = 20 * 1024 * 1024
+CONTACT_COLUMNS = {"email": "email", "sms": "telephone"}
+# Fichiers importés gardés analysés en cache (un par contenu distinct)
+CONTACT_CACHE_ENTRIES = 4
+# Colonnes ajoutées par la normalisation des numéros (jamais envoyées aux canaux)
+PHONE_E164 = "phone_e164"
+PHONE_VALID = "phone_valid"
+PHONE_COLUMNS = [PHONE_E164, PHONE_VALID]
+
+def resolve_variable_values(df, variables, var_mapping, default_values, fallback="[{var}]"):
+    """Prépare les valeurs de personnalisation de tous les destinataires en un seul passage.
+
+    Chaque variable est résolue colonne par colonne (valeurs manquantes, espaces,
+    chaînes vides -> valeur par défaut) puis les colonnes sont regroupées en un
+    tuple de valeurs par destinataire, dans l'ordre de `variables`.
+    `fallback` est utilisé quand aucune valeur par défaut n'est définie.
+    """
+    columns = []
+    for var in variables:
+        default = default_values.get(var)
+        if default is None:
+            default = fallback.format(var=var)
+        column = var_mapping.get(var)
+
+        if column is None or column not in df.columns:
+            columns.append([default] * len(df))
+            continue
+
+        series = df[column]
+        text = series.astype(str).str.strip()
+        text = text.mask(series.isna() | (text == ""), default)
+        columns.append(text.tolist())
+
+    if not columns:
+        return [()] * len(df)
+    return list(zip(*columns))
+
+def column_values(df, column):
+    """Valeurs nettoyées (texte, sans espaces autour) d'une colonne, "" si absente ou vide"""
+    if column not in df.columns:
+        return [""] * len(df)
+    return df[column].fillna("").astype(str).str.strip().tolist()
+
+def with_phone_columns(df):
+    """Ajoute `phone_e164` et `phone_valid` : la colonne `telephone` est validée et formatée
+    une seule fois, les appels suivants réutilisent ces colonnes"""
+    if "telephone" not in df.columns or PHONE_VALID in df.columns:
+        return df
+    phone_e164, phone_valid = normalize_cameroon_phones(df["telephone"])
+    return df.assign(**{PHONE_E164: phone_e164, PHONE_VALID: phone_valid})
+
+def channel_contacts(df, channel):
+    """Contacts joignables sur un canal : email renseigné, ou numéro camerounais valide (format international)"""
+    column = "email" if channel == "email" else "telephone"
+    if column not in df.columns:
+        return df.iloc[0:0].drop(columns=PHONE_COLUMNS, errors="ignore")
+    if channel == "email":
+        return df[df[column].notna()].drop(columns=PHONE_COLUMNS, errors="ignore")
+    contacts = with_phone_columns(df)
+    contacts = contacts[contacts[PHONE_VALID]]
+    return contacts.assign(telephone=contacts[PHONE_E164]).drop(columns=PHONE_COLUMNS)
+
+def read_contact_chunks(source, chunksize=CONTACT_CHUNK_SIZE, **read_options):
+    """Lit un CSV de contacts par morceaux de `chunksize` lignes (mémoire bornée quelle que soit la taille)"""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    yield from pd.read_csv(source, chunksize=chunksize, **read_options)
+
+def iter_channel_contacts(source, channel, chunksize=CONTACT_CHUNK_SIZE, **read_options):
+    """Morceaux de contacts validés et normalisés pour un canal, lus en flux depuis un CSV"""
+    for chunk in read_contact_chunks(source, chunksize, **read_options):
+        contacts = channel_contacts(chunk, channel)
+        if not contacts.empty:
+            yield contacts
+
+def iter_contact_chunks(contacts):
+    """Un DataFrame ou un itérable de DataFrames (lecture en flux), vu comme une suite de morceaux"""
+    if isinstance(contacts, pd.DataFrame):
+        yield contacts
+    else:
+        yield from contacts
+
+def count_contacts(contacts):
+    """Nombre de contacts s'il est connu sans tout lire (DataFrame), sinon None"""
+    return len(contacts) if isinstance(contacts, pd.DataFrame) else None
+
+def count_channel_contacts(contacts):
+    """Nombre de lignes et de contacts joignables par canal (DataFrame ou morceaux lus en flux)"""
+    counts = {"total": 0, "email": 0, "sms": 0}
+    for chunk in iter_contact_chunks(contacts):
+        counts["total"] += len(chunk)
+        counts["email"] += len(channel_contacts(chunk, "email"))
+        counts["sms"] += len(channel_contacts(chunk, "sms"))
+    return counts
+
+def iter_recipient_values(contacts, column, variables, var_mapping, default_values, fallback="[{var}]"):
+    """(destinataire, tuple de valeurs) de chaque contact, préparés morceau par morceau"""
+    for chunk in iter_contact_chunks(contacts):
+        yield from zip(
+            column_values(chunk, column),
+            resolve_variable_values(chunk, variables, var_mapping, default_values, fallback)
+        )
+
+def contact_file_hash(uploaded_file):
+    """Empreinte du contenu d'un fichier importé, calculée une fois par fichier et gardée en session"""
+    key = f"contact_hash_{uploaded_file.file_id}"
+    if key not in st.session_state:
+        st.session_state[key] = content_hash(uploaded_file)
+    return st.session_state[key]
+
+@st.cache_resource(max_entries=CONTACT_CACHE_ENTRIES, show_spinner="📊 Analyse des contacts...")
+def load_contact_file(file_hash, _uploaded_file, streaming):
+    """Lit et analyse un fichier de contacts une seule fois par contenu (`file_hash`).
+
+    Les relances du script à chaque interaction réutilisent le résultat :
+    aperçu `df`, comptes, canaux détectés et, hors lecture en flux, les
+    contacts déjà validés de chaque canal (numéros au format international).
+    Résultat partagé sans copie : il ne doit pas être modifié.
+    """
+    _uploaded_file.seek(0)
+    df = pd.read_csv(_uploaded_file, nrows=CONTACT_CHUNK_SIZE if streaming else None)
+    if streaming:
+        # Comptage en flux sur les seules colonnes de contact
+        counts = count_channel_contacts(read_contact_chunks(
+            _uploaded_file, usecols=lambda column: column in CONTACT_COLUMNS.values()
+        ))
+        contacts = {}
+    else:
+        # Numéros validés et formatés une fois, réutilisés par les contacts SMS
+        df = with_phone_columns(df)
+        contacts = {channel: channel_contacts(df, channel) for channel in CONTACT_COLUMNS}
+        counts = {"total": len(df), "email": len(contacts["email"]), "sms": len(contacts["sms"])}
+    return {
+        "df": df,
+        "counts": counts,
+        "channels": {channel: counts[channel] > 0 for channel in CONTACT_COLUMNS},
+        "contacts": contacts,
+    }
@@ -37,4 +37,4 @@ def save_email_templates(email_templates):
 
 def save_sms_templates(sms_templates):
     with open("sms_templates.json", "w") as f:
-        json.dump(sms_templates, f, indent=4)
\ No newline at end of file
+        json.dump(sms_templates, f, indent=4)
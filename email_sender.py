@@ -1,30 +1,77 @@
+import queue
+import threading
 import streamlit as st
 import pandas as pd
-import smtplib, ssl, re
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
+from collections import deque
 from datetime import datetime
+from smtp_pool import SMTPWorkerPool, DEFAULT_MAX_RECIPIENTS, get_max_recipients
+from template_renderer import compile_template, extract_template_variables
+from contact_manager import (
+    PHONE_COLUMNS, STREAMING_THRESHOLD, resolve_variable_values, count_contacts, iter_recipient_values,
+    channel_contacts, iter_channel_contacts, contact_file_hash, load_contact_file
+)
+from mime_builder import MessageBuilder
+from smtp_connections import get_connection_manager
+from rate_limiter import get_quota_store, get_send_rate
+from send_journal import get_send_journal
+from progress_reporter import StreamlitProgress
+from send_pipeline import SendPipeline
+from log_spool import open_campaign_spool
+from send_results import SendResults, STATUS_SENT, STATUS_FAILED, STATUS_INVALID, SMTP_OK, reply_code
+from render_pool import ProcessRenderStage, get_render_processes
 
-def safe_get_value(var, row, var_mapping, default_values):
-    """Version sécurisée pour récupérer les valeurs des variables"""
-    try:
-        if var in var_mapping and var_mapping[var] in row:
-            value = row[var_mapping[var]]
-            # Vérifier tous les cas de valeurs nulles
-            if pd.isna(value) or value is None or str(value).strip() == "":
-                return default_values.get(var, f"[{var}]") or f"[{var}]"
-            return str(value).strip()
-        else:
-            return default_values.get(var, f"[{var}]") or f"[{var}]"
-    except Exception:
-        return default_values.get(var, f"[{var}]") or f"[{var}]"
+# Nombre de groupes de messages identiques gardés en attente en mode groupé
+MAX_OPEN_GROUPS = 1000
+# Intervalle de mise à jour des résultats et de l'avancement pendant l'envoi (secondes)
+PROGRESS_INTERVAL = 0.1
+
+def build_attachment_part(attachment_file):
+    """Encode la pièce jointe une seule fois en partie MIME réutilisable pour tous les messages"""
+    attachment_file.seek(0)
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(attachment_file.read())
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", "attachment", filename=attachment_file.name)
+    return part
+
+def send_email_campaign(df, email_config, var_mapping, default_values, attachment_file=None, max_connections=None,
+                        progress=None, total=None):
+    """Version modulaire pour l'envoi d'emails (CORRIGÉE)
+
+    Les messages passent par des étapes concurrentes reliées par des files
+    bornées (voir `send_pipeline.SendPipeline`) : lecture des contacts,
+    personnalisation, construction MIME puis envoi en parallèle par un pool de
+    connexions SMTP (voir `smtp_pool.SMTPWorkerPool`). Si `email_config` contient
+    une liste `accounts` ({"name", "config", "weight"}), les destinataires sont
+    répartis entre ces comptes avec bascule automatique en cas de panne ou de quota.
 
-def send_email_campaign(df, email_config, var_mapping, default_values, attachment_file=None):
-    """Version modulaire pour l'envoi d'emails (CORRIGÉE)"""
+    Avec `batch_identical` dans `email_config`, les destinataires dont le message
+    personnalisé est identique (mêmes valeurs de variables) sont regroupés dans un
+    seul envoi SMTP à plusieurs RCPT TO, avec un en-tête To neutre, par lots de
+    `batch_size` adresses au plus (limité par `max_recipients` des comptes).
+
+    Avec `render_processes` dans `email_config` (nombre ou "auto"), la
+    personnalisation et la construction MIME sont réparties sur un pool de
+    processus au lieu de tourner dans un seul thread.
+
+    `progress(done, total, message=None, final=False)` reçoit l'avancement
+    (barre Streamlit par défaut, rafraîchie à intervalle limité).
+
+    `df` peut aussi être un itérable de DataFrames (lecture du CSV en flux) :
+    les contacts sont alors traités morceau par morceau, et `total` donne le
+    nombre attendu pour l'avancement.
+
+    `statuses` (send_results.SendResults) garde le statut, le code de réponse
+    et la latence de chaque destinataire ; `logs` en est une vue lisible
+    produite à la demande.
+    """
     
-    logs, success_count, error_count = [], 0, 0
+    # Résultats par destinataire en colonnes compactes ; logs lisibles produits à la demande
+    spool = open_campaign_spool(email_config, "email")
+    statuses = SendResults("email", spool)
+    success_count, error_count = 0, 0
     smtp_config = email_config["config_data"]
     template = email_config["template_data"]
     
@@ -33,93 +80,221 @@ def send_email_campaign(df, email_config, var_mapping, default_values, attachmen
     text_template = template.get("text", "") or ""
     subject_template = template.get("subject", "Sans objet") or "Sans objet"
     
+    # Templates compilés une seule fois pour toute la campagne
+    all_vars = extract_template_variables(html_template, text_template, subject_template)
+    compiled_html = compile_template(html_template, "email", all_vars)
+    compiled_text = compile_template(text_template, "email", all_vars)
+    compiled_subject = compile_template(subject_template, "email", all_vars)
+    
+    # Pièce jointe encodée une fois pour toute la campagne
+    attachment_part = None
+    if attachment_file is not None:
+        try:
+            attachment_part = build_attachment_part(attachment_file)
+        except Exception as e:
+            statuses.note(f"⚠️ Erreur pièce jointe: {str(e)}")
+    
+    # Squelette MIME préparé une seule fois pour toute la campagne
+    builder = MessageBuilder(compiled_subject, compiled_text, compiled_html, attachment_part)
+    
+    total = count_contacts(df) if total is None else total
+    done = 0
+    progress = progress or StreamlitProgress()
+    
+    # Journal des envois (reprise après interruption, renvoi des échecs)
+    campaign_id = email_config.get("campaign_id")
+    journal = get_send_journal() if campaign_id else None
+    
+    # Rang dans la liste des destinataires en cours d'envoi (les résultats reviennent dans le désordre)
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+    
+    def take_index(email_dest):
+        with in_flight_lock:
+            indexes = in_flight.get(email_dest)
+            if not indexes:
+                return -1
+            index = indexes.popleft()
+            if not indexes:
+                del in_flight[email_dest]
+            return index
+    
+    def collect(results):
+        nonlocal success_count, error_count, done
+        if journal is not None:
+            journal.record(campaign_id, "email", results)
+        for email_dest, error, _, latency in results:
+            index = take_index(email_dest)
+            if error is None:
+                statuses.record(email_dest, STATUS_SENT, SMTP_OK, latency, index=index)
+                success_count += 1
+            else:
+                statuses.record(email_dest, STATUS_FAILED, reply_code(error), latency, error, index)
+                error_count += 1
+            done += 1
+        if results:
+            progress(done, total)
+    
+    accounts = email_config.get("accounts") or [
+        {"name": email_config.get("smtp") or smtp_config["email"], "config": smtp_config}
+    ]
+    # Connexions chaudes réutilisées d'une campagne à l'autre, cadence et quotas par compte
+    pool = SMTPWorkerPool(accounts, max_connections, connections=get_connection_manager(), quotas=get_quota_store())
+    for account in pool.accounts:
+        if account.limiter is not None and account.limiter.bucket is not None:
+            rate = get_send_rate(account.limiter.limits) * 60
+            statuses.note(f"⏱️ Compte {account.name}: cadence limitée à {rate:.1f} envoi(s)/min")
+    
+    # Envoi groupé des messages identiques
+    batch_identical = bool(email_config.get("batch_identical"))
+    batch_size = min(
+        [int(email_config.get("batch_size") or DEFAULT_MAX_RECIPIENTS)]
+        + [get_max_recipients(account["config"]) for account in accounts]
+    )
+    
+    # Adresses invalides écartées à la lecture, enregistrées par le thread de la page
+    invalid = queue.Queue()
+    
+    def ingest():
+        """Lecture : (To, destinataires d'enveloppe, valeurs) de chaque message à envoyer"""
+        # Données de personnalisation préparées en un passage vectorisé par morceau de contacts
+        recipients = iter_recipient_values(df, "email", all_vars, var_mapping, default_values)
+        groups = {}
+        for index, (email_dest, values) in enumerate(recipients):
+            if not email_dest or "@" not in email_dest:
+                invalid.put((index, email_dest))
+                continue
+            with in_flight_lock:
+                in_flight.setdefault(email_dest, deque()).append(index)
+            if not batch_identical:
+                yield email_dest, (email_dest,), values
+                continue
+            # Regroupement par contenu : mêmes valeurs => même message
+            group = groups.setdefault(values, [])
+            group.append(email_dest)
+            if len(group) >= batch_size:
+                yield None, groups.pop(values), values
+            elif len(groups) > MAX_OPEN_GROUPS:
+                # Liste très personnalisée : on n'attend pas indéfiniment les plus anciens groupes
+                oldest = next(iter(groups))
+                yield None, groups.pop(oldest), oldest
+        for values, group in groups.items():
+            yield None, group, values
+    
+    def render(items):
+        """Personnalisation des textes"""
+        for email_dest, recipients, values in items:
+            yield email_dest, recipients, builder.render(values)
+    
+    def build(items):
+        """Encodage et assemblage MIME (octets prêts à l'envoi)"""
+        for email_dest, recipients, rendered in items:
+            yield recipients, builder.assemble(email_dest, rendered)
+    
+    def transmit(items):
+        """Envoi délégué aux workers SMTP ; `submit` bloque quand leurs files sont pleines"""
+        try:
+            for recipients, message in items:
+                pool.submit(recipients, message)
+        finally:
+            pool.close()
+    
+    def record():
+        """Enregistrement des résultats disponibles (journal, compteurs, logs, avancement)"""
+        nonlocal error_count, done
+        rejected = []
+        while True:
+            try:
+                rejected.append(invalid.get_nowait())
+            except queue.Empty:
+                break
+        for index, email_dest in rejected:
+            statuses.record(email_dest, STATUS_INVALID, index=index)
+            error_count += 1
+            done += 1
+        if journal is not None:
+            journal.record(campaign_id, "email", [(email_dest, "email invalide", None) for _, email_dest in rejected])
+        collect(pool.drain())
+    
+    progress(done, total, f"🔌 Ouverture de {pool.max_connections} connexion(s) SMTP...")
+    
+    # Étapes concurrentes reliées par des files bornées : lecture -> personnalisation ->
+    # construction MIME -> envoi ; l'enregistrement se fait ici, dans le thread de la page
+    render_processes = get_render_processes(email_config.get("render_processes"))
+    if render_processes > 1:
+        # Rendu sur plusieurs cœurs : une seule étape remplace personnalisation et construction
+        pipeline = SendPipeline(ingest(), ProcessRenderStage(builder, render_processes), transmit)
+        statuses.note(f"🧮 Messages préparés par {render_processes} processus")
+    else:
+        pipeline = SendPipeline(ingest(), render, build, transmit)
     try:
-        context = ssl.create_default_context()
+        pool.start()
+        pipeline.start()
+        
+        while not pipeline.join(timeout=PROGRESS_INTERVAL):
+            record()
+            progress(done, total, "📧 Envoi en cours...")
+        record()
+        pipeline.raise_error()
+        
+        progress(done, total, "✅ Envoi des emails terminé!", final=True)
         
-        with smtplib.SMTP(smtp_config["server"], smtp_config["port"]) as server:
-            server.starttls(context=context)
-            server.login(smtp_config["email"], smtp_config["password"])
-            
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            for index, row in df.iterrows():
-                # Récupérer l'email de manière sécurisée
-                email_dest = str(row.get("email", "") or "").strip()
-                
-                if not email_dest or "@" not in email_dest:
-                    logs.append(f"❌ Email invalide ignoré: {email_dest}")
-                    error_count += 1
-                    continue
-                
-                status_text.text(f"📧 Envoi à {email_dest}... ({index + 1}/{len(df)})")
-                
-                # Personnalisation du message - VERSION SÉCURISÉE
-                personalized_html = html_template
-                personalized_text = text_template
-                personalized_subject = subject_template
-                
-                # Trouver toutes les variables dans tous les templates
-                all_vars = set(re.findall(r'\[(.*?)\]', html_template + text_template + subject_template))
-                
-                for var in all_vars:
-                    # Utiliser la fonction sécurisée
-                    value = safe_get_value(var, row, var_mapping, default_values)
-                    
-                    # S'assurer que la valeur n'est jamais None
-                    safe_value = str(value) if value is not None else f"[{var}]"
-                    
-                    # Remplacer dans tous les templates
-                    personalized_html = personalized_html.replace(f"[{var}]", safe_value)
-                    personalized_text = personalized_text.replace(f"[{var}]", safe_value)
-                    personalized_subject = personalized_subject.replace(f"[{var}]", safe_value)
-                
-                # Création du message
-                message = MIMEMultipart("mixed")
-                message["From"] = smtp_config['email']
-                message["To"] = email_dest
-                message["Subject"] = personalized_subject
-                
-                alternative = MIMEMultipart('alternative')
-                if personalized_text.strip():
-                    alternative.attach(MIMEText(personalized_text, "plain"))
-                if personalized_html.strip():
-                    alternative.attach(MIMEText(personalized_html, "html"))
-                message.attach(alternative)
-                
-                # Pièce jointe (si fournie)
-                if attachment_file is not None:
-                    try:
-                        attachment_file.seek(0)
-                        part = MIMEBase("application", "octet-stream")
-                        part.set_payload(attachment_file.read())
-                        encoders.encode_base64(part)
-                        part.add_header("Content-Disposition", f"attachment; filename={attachment_file.name}")
-                        message.attach(part)
-                    except Exception as e:
-                        logs.append(f"⚠️ Erreur pièce jointe pour {email_dest}: {str(e)}")
-                
-                try:
-                    server.sendmail(smtp_config["email"], email_dest, message.as_string())
-                    logs.append(f"✅ Email envoyé à {email_dest}")
-                    success_count += 1
-                except Exception as e:
-                    logs.append(f"❌ Erreur {email_dest}: {str(e)}")
-                    error_count += 1
-                
-                progress_bar.progress((index + 1) / len(df))
-            
-            status_text.text("✅ Envoi des emails terminé!")
-            
     except Exception as e:
         # Message d'erreur sécurisé
         error_msg = f"❌ Erreur SMTP globale: {str(e) if e else 'Erreur inconnue'}"
-        logs.append(error_msg)
+        statuses.note(error_msg)
+        pipeline.stop()
+        pipeline.join()
+        pool.close()
+        record()
+    except BaseException:
+        # Relance ou arrêt de la page (RerunException, StopException) : plus rien ne part,
+        # et ce qui est déjà parti est journalisé pour que la reprise ne le renvoie pas
+        pipeline.stop()
+        pool.abort()
+        record()
+        if journal is not None:
+            journal.flush()
+        spool.close()
+        raise
+    
+    if journal is not None:
+        journal.flush()
+    
+    # Comptes désactivés (connexion, authentification ou quota)
+    for error in pool.errors:
+        statuses.note(f"❌ Erreur SMTP globale: {error}")
+    
+    if pool.retried:
+        statuses.note(f"🔁 {pool.retried} nouvelle(s) tentative(s) après échec temporaire")
+    
+    # Régulation appliquée par les serveurs qui ont demandé de ralentir
+    for account in pool.accounts:
+        controller = account.controller
+        if controller.rate is not None:
+            statuses.note(
+                f"⚙️ Compte {account.name} ralenti par le serveur: {int(controller.window)} envoi(s) simultané(s), "
+                f"{controller.rate * 60:.0f} envoi(s)/min"
+            )
+    
+    if len(pool.accounts) > 1:
+        for account in pool.accounts:
+            state = "❌ désactivé" if account.dead else "✅"
+            statuses.note(f"📊 Compte {account.name} {state}: {account.sent} email(s) envoyé(s)")
+    
+    spool.close()
     
     return {
         "success_count": success_count,
         "error_count": error_count,
-        "logs": logs
+        "logs": statuses.logs,
+        "statuses": statuses,
+        "log_path": spool.path,
+        # Échecs définitifs (5xx ou tentatives épuisées)
+        "dead_letters": [
+            {"email": email_dest, "erreur": error, "compte": name}
+            for email_dest, error, name in pool.dead_letters
+        ]
     }
 
 def send_email_section():
@@ -137,12 +312,15 @@ def send_email_section():
     attachment_file = st.file_uploader("Pièce jointe (facultatif)")
 
     if uploaded_file and selected_template:
-        df = pd.read_csv(uploaded_file)
-        if "email" not in df.columns:
+        # Même lecture que la campagne multi-canal : gros fichiers relus en flux à l'envoi
+        streaming = uploaded_file.size > STREAMING_THRESHOLD
+        contact_file = load_contact_file(contact_file_hash(uploaded_file), uploaded_file, streaming)
+        if "email" not in contact_file["df"].columns:
             st.error("Le CSV doit contenir une colonne 'email'")
             return
-        df = df.dropna(subset=["email"])
-        st.success(f"{len(df)} destinataires valides trouvés")
+        df = channel_contacts(contact_file["df"], "email")
+        total = contact_file["counts"]["email"]
+        st.success(f"{total} destinataires valides trouvés")
 
         # Charger le template
         template = st.session_state.email_templates[selected_template]
@@ -150,7 +328,7 @@ def send_email_section():
         text_template = template.get("text", "") or ""
 
         # Variables détectées
-        variables = set(re.findall(r'\[(.*?)\]', html_template + text_template))
+        variables = extract_template_variables(html_template, text_template)
         var_mapping, default_values = {}, {}
 
         if variables:
@@ -162,7 +340,7 @@ def send_email_section():
                         var_mapping[var] = var
                         st.write(f"✔️ `{var}` détecté dans CSV (colonne '{var}')")
                     else:
-                        options = [col for col in df.columns if col != 'email']
+                        options = [col for col in df.columns if col not in ['email'] + PHONE_COLUMNS]
                         selected_col = st.selectbox(f"Colonne pour '{var}'", ["(Ignorer)"] + options, key=f"var_{var}")
                         if selected_col != "(Ignorer)":
                             var_mapping[var] = selected_col
@@ -174,12 +352,10 @@ def send_email_section():
         st.subheader("👀 Aperçu du premier email")
         preview_html, preview_text = html_template, text_template
         if not df.empty:
-            for var in variables:
-                # Utiliser la fonction sécurisée pour l'aperçu aussi
-                value = safe_get_value(var, df.iloc[0], var_mapping, default_values)
-                safe_value = str(value) if value is not None else f"[{var}]"
-                preview_html = preview_html.replace(f"[{var}]", safe_value)
-                preview_text = preview_text.replace(f"[{var}]", safe_value)
+            # Même préparation des valeurs que pour l'envoi
+            values = resolve_variable_values(df.iloc[:1], variables, var_mapping, default_values)[0]
+            preview_html = compile_template(html_template, "email", variables).render(values)
+            preview_text = compile_template(text_template, "email", variables).render(values)
 
         if preview_html.strip():
             st.components.v1.html(preview_html, height=400, scrolling=True)
@@ -189,15 +365,22 @@ def send_email_section():
         # Envoi
         smtp_config = st.session_state.smtp_configs[selected_smtp]
         password = st.text_input("Mot de passe SMTP", type="password", value=smtp_config["password"])
+        batch_identical = st.checkbox(
+            "📦 Regrouper les emails identiques",
+            help="Un seul envoi SMTP pour plusieurs destinataires recevant exactement le même message (en-tête To neutre)"
+        )
         if st.button("🚀 Démarrer l'envoi des emails"):
             
             # Utilisation de la nouvelle fonction modulaire
             email_config = {
+                "smtp": selected_smtp,
                 "config_data": smtp_config,
-                "template_data": template
+                "template_data": template,
+                "batch_identical": batch_identical
             }
             
-            results = send_email_campaign(df, email_config, var_mapping, default_values, attachment_file)
+            contacts = iter_channel_contacts(uploaded_file, "email") if streaming else df
+            results = send_email_campaign(contacts, email_config, var_mapping, default_values, attachment_file, total=total)
             
             # Affichage des résultats
             st.subheader("📊 Résultats")
@@ -208,6 +391,6 @@ def send_email_section():
             # Téléchargement des logs
             st.download_button(
                 "📥 Télécharger les logs", 
-                "\n".join(results['logs']), 
+                lambda: "\n".join(results['logs']),
                 file_name=f"logs_email_{datetime.now().strftime('%Y%m%d')}.txt"
             )
\ No newline at end of file
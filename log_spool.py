@@ -0,0 +1,156 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+# Dossier des logs de campagne (un fichier JSONL par campagne et par canal)
+LOG_DIR = "campaign_logs"
+# Taille d'un fichier avant rotation, et nombre d'anciens fichiers gardés
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUPS = 20
+# Taille maximale d'un fichier servi dans la page (Streamlit le garde en mémoire pour la session)
+DOWNLOAD_MAX_BYTES = 200 * 1024 * 1024
+# Taille des blocs lus depuis la fin d'un log (dernières entrées)
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Handlers ouverts par fichier dans ce processus, avec leur nombre d'utilisateurs
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+def spool_path(name):
+    return os.path.join(LOG_DIR, f"{name}.jsonl")
+
+def spool_files(path):
+    """Fichiers d'un log tournant, du plus ancien au plus récent"""
+    backups = [f"{path}.{index}" for index in range(LOG_BACKUPS, 0, -1)]
+    return [part for part in backups + [path] if os.path.exists(part)]
+
+def spool_size(path):
+    """Taille totale d'un log, rotations comprises (octets)"""
+    return sum(os.path.getsize(part) for part in spool_files(path))
+
+def write_file(target, write):
+    """Écrit `target` par `write(f)` dans un fichier temporaire du même dossier, renommé une fois complet"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return target
+
+def export_spool(path, compress=False):
+    """Log complet (rotations comprises) dans un seul fichier sur disque, compressé en gzip si demandé.
+
+    Copie par blocs : la mémoire ne dépend pas de la taille du log. Retourne
+    le chemin du fichier (le log lui-même s'il n'a pas tourné et n'est pas compressé).
+    """
+    parts = spool_files(path)
+    if not compress and len(parts) == 1:
+        return parts[0]
+
+    def write(f):
+        target = gzip.GzipFile(fileobj=f, mode="wb") if compress else f
+        for part in parts:
+            with open(part, "rb") as source:
+                shutil.copyfileobj(source, target)
+        if compress:
+            target.close()
+
+    return write_file(f"{path}.gz" if compress else f"{path}.all", write)
+
+def read_download(path):
+    """Contenu d'un fichier pour un téléchargement dans la page, refusé au-delà de DOWNLOAD_MAX_BYTES.
+
+    Le fichier est lu puis refermé aussitôt : Streamlit garde de toute façon
+    le contenu en mémoire, et aucun descripteur ne reste ouvert sur le serveur.
+    """
+    size = os.path.getsize(path)
+    if size > DOWNLOAD_MAX_BYTES:
+        raise ValueError(f"{path} ({size // (1024 * 1024)} Mo) est trop volumineux pour la page : récupérez-le sur le serveur")
+    with open(path, "rb") as f:
+        return f.read()
+
+def iter_spool(path):
+    """Entrées (dictionnaires) d'un log, du plus ancien au plus récent"""
+    for part in spool_files(path):
+        with open(part, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def iter_spool_reversed(path, block_size=TAIL_BLOCK_SIZE):
+    """Entrées d'un log du plus récent au plus ancien, lues par blocs depuis la fin des fichiers"""
+    for part in reversed(spool_files(path)):
+        with open(part, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            rest = b""
+            while end > 0:
+                start = max(0, end - block_size)
+                f.seek(start)
+                lines = (f.read(end - start) + rest).split(b"\n")
+                end = start
+                # Première ligne du bloc peut-être incomplète : complétée par le bloc précédent
+                rest = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield json.loads(line)
+            if rest.strip():
+                yield json.loads(rest)
+
+def open_campaign_spool(config, channel):
+    """Log d'une campagne sur un canal, nommé d'après `log_name` ou `campaign_id` de sa configuration.
+
+    Le nom porte le numéro du processus : la rotation n'est pas sûre entre
+    processus, la page et un job d'arrière-plan de la même campagne écrivent
+    donc chacun dans son fichier.
+    """
+    name = config.get("log_name") or config.get("campaign_id")
+    if not name:
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    return LogSpool(f"{name}_{channel}_{os.getpid()}")
+
+class LogSpool:
+    """Log d'une campagne écrit au fil de l'envoi : une ligne JSON par événement.
+
+    Le fichier tourne à LOG_MAX_BYTES (RotatingFileHandler) : rien n'est
+    gardé en mémoire, et les téléchargements sont servis depuis le disque.
+    Relancer une campagne (même nom) ajoute à son log existant. Dans un même
+    processus, les envois vers le même fichier partagent un seul handler ;
+    un fichier ne doit pas être ouvert par deux processus (voir `open_campaign_spool`).
+    """
+
+    def __init__(self, name, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        os.makedirs(LOG_DIR, exist_ok=True)
+        self.path = spool_path(name)
+        with _handlers_lock:
+            handler, users = _handlers.get(self.path, (None, 0))
+            if handler is None:
+                handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+            _handlers[self.path] = (handler, users + 1)
+        self._handler = handler
+
+    def write(self, **entry):
+        entry["ts"] = datetime.now().isoformat(timespec="milliseconds")
+        # handle() verrouille le fichier : les workers SMTP peuvent écrire en parallèle
+        self._handler.handle(logging.makeLogRecord({"msg": json.dumps(entry, ensure_ascii=False)}))
+
+    def close(self):
+        if self._handler is None:
+            return
+        with _handlers_lock:
+            handler, users = _handlers.pop(self.path)
+            if users > 1:
+                _handlers[self.path] = (handler, users - 1)
+            else:
+                handler.close()
+        self._handler = None
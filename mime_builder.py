@@ -0,0 +1,128 @@
+import base64
+import uuid
+from email import policy
+from email.header import Header
+
+CRLF = b"\r\n"
+# En-tête To neutre pour les messages envoyés à plusieurs destinataires d'enveloppe
+UNDISCLOSED_RECIPIENTS = b"To: undisclosed-recipients:;\r\n"
+
+def _boundary():
+    return f"=_{uuid.uuid4().hex}"
+
+def _clean_header(value):
+    """Empêche l'injection d'en-têtes via les données du CSV"""
+    return " ".join(str(value).splitlines())
+
+def encode_header(name, value):
+    """En-tête prêt à l'envoi, encodé RFC 2047 si nécessaire et replié en CRLF"""
+    value = _clean_header(value)
+    charset = "us-ascii" if value.isascii() else "utf-8"
+    encoded = Header(value, charset, header_name=name).encode(linesep="\r\n")
+    return f"{name}: {encoded}\r\n".encode("ascii")
+
+def encode_body(text):
+    """Corps texte encodé en UTF-8 / base64 (lignes de 76 caractères, CRLF)"""
+    return base64.encodebytes(text.encode("utf-8")).replace(b"\n", CRLF)
+
+class MessageBuilder:
+    """Construit les messages d'une campagne directement en octets.
+
+    Le squelette MIME (frontières, en-têtes de parties, pièce jointe encodée et
+    parties sans variable) est préparé une seule fois ; pour chaque destinataire
+    seuls To, Subject et les corps personnalisés sont encodés puis assemblés.
+    Le message produit n'a pas d'en-tête From : il est ajouté par le worker SMTP
+    selon le compte utilisé.
+    """
+
+    def __init__(self, compiled_subject, compiled_text, compiled_html, attachment_part=None):
+        self.compiled_subject = compiled_subject
+        self.compiled_text = compiled_text
+        self.compiled_html = compiled_html
+
+        mixed = _boundary()
+        alternative = _boundary()
+
+        self._head = (
+            b"MIME-Version: 1.0\r\n"
+            b'Content-Type: multipart/mixed; boundary="' + mixed.encode() + b'"\r\n'
+            b"\r\n"
+            b"--" + mixed.encode() + CRLF +
+            b'Content-Type: multipart/alternative; boundary="' + alternative.encode() + b'"\r\n'
+            b"\r\n"
+        )
+        self._text_head = (
+            b"--" + alternative.encode() + CRLF +
+            b'Content-Type: text/plain; charset="utf-8"\r\n'
+            b"Content-Transfer-Encoding: base64\r\n"
+            b"\r\n"
+        )
+        self._html_head = (
+            b"--" + alternative.encode() + CRLF +
+            b'Content-Type: text/html; charset="utf-8"\r\n'
+            b"Content-Transfer-Encoding: base64\r\n"
+            b"\r\n"
+        )
+
+        tail = b"--" + alternative.encode() + b"--\r\n"
+        if attachment_part is not None:
+            tail += b"--" + mixed.encode() + CRLF + attachment_part.as_bytes(policy=policy.SMTP)
+            if not tail.endswith(CRLF):
+                tail += CRLF
+        tail += b"--" + mixed.encode() + b"--\r\n"
+        self._tail = tail
+
+        # Parties sans variable : encodées une fois pour toutes
+        self._static_subject = self._encode_subject(compiled_subject.render(())) if compiled_subject.is_static else None
+        self._static_text = self._encode_text(compiled_text.render(())) if compiled_text.is_static else None
+        self._static_html = self._encode_html(compiled_html.render(())) if compiled_html.is_static else None
+
+    def _encode_subject(self, subject):
+        return encode_header("Subject", subject)
+
+    def _encode_text(self, text):
+        if not text.strip():
+            return b""
+        return self._text_head + encode_body(text)
+
+    def _encode_html(self, html):
+        if not html.strip():
+            return b""
+        return self._html_head + encode_body(html)
+
+    def render(self, values):
+        """Textes personnalisés (sujet, texte, html) d'un destinataire ; None pour les parties sans variable"""
+        return (
+            None if self._static_subject is not None else self.compiled_subject.render(values),
+            None if self._static_text is not None else self.compiled_text.render(values),
+            None if self._static_html is not None else self.compiled_html.render(values),
+        )
+
+    def assemble(self, email_dest, rendered):
+        """Encode les textes produits par `render` et assemble le message (octets, CRLF).
+
+        Avec `email_dest=None` l'en-tête To est neutre (envoi groupé).
+        """
+        subject, text, html = rendered
+        subject = self._static_subject if subject is None else self._encode_subject(subject)
+        text = self._static_text if text is None else self._encode_text(text)
+        html = self._static_html if html is None else self._encode_html(html)
+        if not text and not html:
+            # Partie alternative vide : on garde au moins une partie texte
+            text = self._text_head
+
+        return b"".join((
+            encode_header("To", email_dest) if email_dest else UNDISCLOSED_RECIPIENTS,
+            subject,
+            self._head,
+            text,
+            html,
+            self._tail,
+        ))
+
+    def build(self, email_dest, values):
+        """Message complet (octets, CRLF) pour un destinataire et son tuple de valeurs.
+
+        Avec `email_dest=None` l'en-tête To est neutre (envoi groupé).
+        """
+        return self.assemble(email_dest, self.render(values))
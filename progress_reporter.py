@@ -0,0 +1,109 @@
+import logging
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+import streamlit as st
+
+# Intervalle minimal entre deux mises à jour de la page (secondes)
+PROGRESS_INTERVAL = 0.25
+# Fichier où sont écrits les messages envoyés un par un (hors de la page)
+SEND_LOG_PATH = "send.log"
+# Taille à laquelle send.log tourne, et nombre d'anciens fichiers gardés
+SEND_LOG_MAX_BYTES = 20 * 1024 * 1024
+SEND_LOG_BACKUPS = 5
+
+_logger_lock = threading.Lock()
+
+def format_duration(seconds):
+    """Durée lisible : 45s, 3m05s, 1h02m"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def describe_rate(done, total, elapsed):
+    """Débit et temps restant estimé, ex. "12.5/s, reste ~3m05s\""""
+    rate = done / elapsed if elapsed > 0 else 0.0
+    text = f"{rate:.1f}/s"
+    if total and rate > 0 and done < total:
+        text += f", reste ~{format_duration((total - done) / rate)}"
+    return text
+
+def get_send_logger():
+    """Logger des envois message par message, écrit dans SEND_LOG_PATH (qui tourne à SEND_LOG_MAX_BYTES) plutôt que dans la page"""
+    logger = logging.getLogger("mailing.send")
+    with _logger_lock:
+        if not logger.handlers:
+            handler = RotatingFileHandler(
+                SEND_LOG_PATH, maxBytes=SEND_LOG_MAX_BYTES, backupCount=SEND_LOG_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    return logger
+
+class StreamlitProgress:
+    """Avancement d'un envoi affiché dans la page Streamlit (barre + texte).
+
+    Les fonctions d'envoi reçoivent un `progress(done, total, message=None, final=False)` ;
+    celui-ci est utilisé par défaut quand la campagne tourne dans la page.
+    Chaque mise à jour part vers le navigateur : la page n'est rafraîchie
+    qu'au plus toutes les `interval` secondes (ou tous les `every` envois),
+    avec le débit et le temps restant estimé. `final=True` force l'affichage.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL, every=None):
+        self.bar = st.progress(0)
+        self.status = st.empty()
+        self.interval = interval
+        self.every = every
+        self.started = time.monotonic()
+        self._last_update = 0.0
+        self._last_done = 0
+        self._message = None
+
+    def __call__(self, done, total, message=None, final=False):
+        if message:
+            self._message = message
+        now = time.monotonic()
+        if not final and now - self._last_update < self.interval and (
+            not self.every or done - self._last_done < self.every
+        ):
+            return
+        self._last_update = now
+        self._last_done = done
+        if total:
+            self.bar.progress(min(done / total, 1.0))
+        text = self._message or ""
+        if done:
+            text = f"{text} — {done}/{total or '?'}, {describe_rate(done, total, now - self.started)}"
+        self.status.text(text)
+
+class ConsoleProgress:
+    """Avancement écrit sur la sortie standard (exécution sans interface), au plus toutes les `interval` secondes"""
+
+    def __init__(self, label, stream=None, interval=1.0):
+        self.label = label
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last_write = 0.0
+        self._last_done = None
+
+    def __call__(self, done, total, message=None, final=False):
+        now = time.monotonic()
+        finished = final or (bool(total) and done >= total)
+        if (done == self._last_done and not final) or (now - self._last_write < self.interval and not finished):
+            return
+        self._last_write = now
+        self._last_done = done
+        rate = describe_rate(done, total, now - self.started)
+        if total:
+            self.stream.write(f"[{self.label}] {done}/{total} ({done / total * 100:.0f}%) {rate}\n")
+        else:
+            self.stream.write(f"[{self.label}] {done} {rate}\n")
+        self.stream.flush()
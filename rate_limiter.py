@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import streamlit as st
+
+# Limites connues des fournisseurs, appliquées quand la configuration n'en précise pas
+PROVIDER_LIMITS = {
+    "gmail.com": {"rate_per_minute": 20, "hourly_quota": None, "daily_quota": 500},
+    "googlemail.com": {"rate_per_minute": 20, "hourly_quota": None, "daily_quota": 500},
+    "ovh.net": {"rate_per_minute": 10, "hourly_quota": 200, "daily_quota": None},
+    "office365.com": {"rate_per_minute": 30, "hourly_quota": None, "daily_quota": 10000},
+    "outlook.com": {"rate_per_minute": 30, "hourly_quota": None, "daily_quota": 300},
+}
+LIMIT_KEYS = ("rate_per_minute", "hourly_quota", "daily_quota")
+# Attente maximale du verrou d'écriture tenu par un autre processus (secondes)
+BUSY_TIMEOUT = 30.0
+
+# Une ligne par compte et par fenêtre ("2026-10-18" pour le jour, "2026-10-18T14" pour l'heure)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS send_quotas (
+    account TEXT NOT NULL,
+    period TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (account, period)
+);
+"""
+
+class QuotaExceeded(Exception):
+    """Quota journalier du compte atteint : le compte ne peut plus envoyer aujourd'hui"""
+
+def get_send_limits(smtp_config):
+    """Limites d'envoi d'une configuration (valeurs saisies, sinon celles du fournisseur).
+
+    Une valeur None signifie « pas de limite ».
+    """
+    server = str(smtp_config.get("server", "")).lower()
+    provider = next((limits for host, limits in PROVIDER_LIMITS.items() if server.endswith(host)), {})
+    limits = {}
+    for key in LIMIT_KEYS:
+        value = smtp_config.get(key) or provider.get(key)
+        try:
+            limits[key] = int(value) if value and int(value) > 0 else None
+        except (TypeError, ValueError):
+            limits[key] = None
+    return limits
+
+def get_send_rate(limits):
+    """Débit régulier (envois/seconde) qui respecte à la fois la limite par minute et le quota horaire"""
+    rates = []
+    if limits.get("rate_per_minute"):
+        rates.append(limits["rate_per_minute"] / 60)
+    if limits.get("hourly_quota"):
+        rates.append(limits["hourly_quota"] / 3600)
+    return min(rates) if rates else None
+
+def _quota_key(smtp_config):
+    # Les fournisseurs comptent les envois par compte
+    return str(smtp_config["email"]).strip().lower()
+
+def _current_windows():
+    now = datetime.now()
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%dT%H")
+
+class TokenBucket:
+    """Seau à jetons thread-safe : `rate` jetons par seconde, au plus `capacity` en réserve.
+
+    Un appel qui demande plus de jetons que disponible les réserve quand même
+    (solde négatif) et attend le temps nécessaire : les appels concurrents sont
+    ainsi servis dans l'ordre, au débit voulu.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, count=1):
+        """Prend `count` jetons, en attendant si nécessaire ; retourne l'attente en secondes"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class SendRateLimiter:
+    """Limiteur d'un compte SMTP : cadence (seau à jetons) et quotas horaire/journalier"""
+
+    def __init__(self, key, limits, store):
+        self.key = key
+        self.limits = limits
+        self.store = store
+        rate = get_send_rate(limits)
+        # Réserve d'une minute d'envois au plus
+        self.bucket = TokenBucket(rate, max(1, rate * 60)) if rate else None
+
+    def acquire(self, count=1):
+        """Réserve `count` envois, en attendant la cadence ou l'heure suivante si besoin.
+
+        Lève QuotaExceeded si le quota journalier est atteint.
+        """
+        while True:
+            wait = self.store.reserve(self.key, count, self.limits)
+            if not wait:
+                break
+            time.sleep(wait)
+        if self.bucket is not None:
+            self.bucket.take(count)
+
+class SendQuotaStore:
+    """Compteurs d'envoi par compte dans une base SQLite partagée (par défaut celle du journal des envois).
+
+    Chaque réservation lit et incrémente les compteurs dans une même
+    transaction (BEGIN IMMEDIATE) : la page, les jobs en arrière-plan et les
+    workers de la file, sur un ou plusieurs hôtes, comptent contre les mêmes
+    quotas sans s'écraser.
+    """
+
+    def __init__(self, path=None, timeout=BUSY_TIMEOUT):
+        self.path = path or os.environ.get("SEND_QUOTA_PATH") or os.environ.get("SEND_JOURNAL_PATH", "send_journal.db")
+        self._conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._limiters = {}
+        self._lock = threading.Lock()
+        # Les fenêtres des jours précédents ne servent plus
+        day, _ = _current_windows()
+        with self._lock:
+            self._conn.execute("DELETE FROM send_quotas WHERE substr(period, 1, 10) < ?", (day,))
+
+    def limiter(self, smtp_config):
+        """Limiteur partagé d'un compte, ou None s'il n'a aucune limite"""
+        limits = get_send_limits(smtp_config)
+        if not any(limits.values()):
+            return None
+        key = _quota_key(smtp_config)
+        with self._lock:
+            cached = self._limiters.get(key)
+            if cached is None or cached.limits != limits:
+                cached = SendRateLimiter(key, limits, self)
+                self._limiters[key] = cached
+            return cached
+
+    def _counts(self, key):
+        """(envois de l'heure, envois du jour) d'un compte ; à appeler sous `_lock`"""
+        day, hour = _current_windows()
+        rows = dict(self._conn.execute(
+            "SELECT period, count FROM send_quotas WHERE account = ? AND period IN (?, ?)", (key, day, hour)
+        ).fetchall())
+        return rows.get(hour, 0), rows.get(day, 0)
+
+    def reserve(self, key, count, limits):
+        """Comptabilise `count` envois si les quotas le permettent.
+
+        Retourne 0 si les envois sont réservés, sinon le nombre de secondes avant
+        la prochaine heure (quota horaire atteint). Lève QuotaExceeded si le quota
+        journalier est atteint.
+        """
+        day, hour = _current_windows()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                hour_count, day_count = self._counts(key)
+                daily = limits.get("daily_quota")
+                # Un premier envoi plus gros que le quota passe quand même (sinon il ne partirait jamais)
+                if daily and day_count and day_count + count > daily:
+                    raise QuotaExceeded(f"quota journalier atteint ({day_count}/{daily} envois)")
+                hourly = limits.get("hourly_quota")
+                if hourly and hour_count and hour_count + count > hourly:
+                    now = datetime.now()
+                    return max(1, 3600 - now.minute * 60 - now.second)
+                self._conn.executemany(
+                    "INSERT INTO send_quotas (account, period, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (account, period) DO UPDATE SET count = count + excluded.count",
+                    [(key, day, count), (key, hour, count)]
+                )
+            finally:
+                self._conn.execute("COMMIT")
+        return 0
+
+    def usage(self, smtp_config):
+        """Envois déjà comptés pour un compte : (cette heure, aujourd'hui)"""
+        with self._lock:
+            return self._counts(_quota_key(smtp_config))
+
+    def remaining(self, smtp_config):
+        """Envois encore possibles aujourd'hui pour un compte (None si illimité)"""
+        daily = get_send_limits(smtp_config)["daily_quota"]
+        if not daily:
+            return None
+        return max(0, daily - self.usage(smtp_config)[1])
+
+@st.cache_resource
+def get_quota_store():
+    """Compteurs d'envoi du processus Streamlit (les autres processus partagent la même base)"""
+    return SendQuotaStore()
@@ -0,0 +1,60 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Nombre de messages préparés par tâche confiée à un processus
+RENDER_BATCH_SIZE = 200
+# Lots en cours par processus : au-delà, l'étape attend le plus ancien (contre-pression)
+MAX_PENDING_BATCHES = 2
+
+# MessageBuilder du processus de rendu, transmis une seule fois à son démarrage
+_builder = None
+
+def get_render_processes(value):
+    """Nombre de processus de rendu demandé ("auto" = un par cœur), 0 pour rendre dans le thread d'envoi"""
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+def _init_worker(builder):
+    global _builder
+    _builder = builder
+
+def _build_batch(items):
+    return [(recipients, _builder.build(email_dest, values)) for email_dest, recipients, values in items]
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class ProcessRenderStage:
+    """Étape de pipeline qui personnalise et construit les messages dans un pool de processus.
+
+    Reçoit des (To, destinataires, valeurs) et produit des (destinataires,
+    message en octets) dans le même ordre, comme les étapes de rendu et de
+    construction exécutées en thread, mais sur plusieurs cœurs (hors GIL).
+    """
+
+    def __init__(self, builder, processes, batch_size=RENDER_BATCH_SIZE):
+        self.builder = builder
+        self.processes = processes
+        self.batch_size = batch_size
+
+    def __call__(self, items):
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self.builder,)) as executor:
+            pending = deque()
+            for batch in _batches(items, self.batch_size):
+                pending.append(executor.submit(_build_batch, batch))
+                if len(pending) >= self.processes * MAX_PENDING_BATCHES:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import random
+import smtplib
+import threading
+import time
+
+# Nombre maximal de tentatives d'un envoi (première comprise)
+MAX_ATTEMPTS = 5
+# Délai de base et plafond du backoff exponentiel (secondes)
+BASE_DELAY = 2.0
+MAX_DELAY = 120.0
+
+def backoff_delay(attempts, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Délai avant la tentative suivante : backoff exponentiel avec jitter complet.
+
+    Le tirage aléatoire évite que tous les envois échoués au même moment
+    repartent ensemble.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempts - 1)))
+
+def is_transient_error(error):
+    """Indique si l'échec est temporaire (4xx, coupure, délai dépassé) et mérite une nouvelle tentative"""
+    code = getattr(error, "smtp_code", None)
+    if isinstance(code, int):
+        return 400 <= code < 500
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, smtplib.SMTPServerDisconnected)
+    # Réponse HTTP d'une API SMS : seuls la limitation (429) et les erreurs serveur (5xx) sont temporaires
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # Erreurs réseau (socket, timeout, connexion HTTP des API SMS)
+    return isinstance(error, (OSError, TimeoutError))
+
+class RetryQueue:
+    """File des envois à retenter, chacun disponible une fois son délai écoulé.
+
+    `schedule` refuse l'élément quand le nombre maximal de tentatives est
+    atteint : l'appelant le classe alors en échec définitif.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+    def schedule(self, item, attempts):
+        """Planifie une nouvelle tentative après `attempts` échecs ; False si la limite est atteinte"""
+        if attempts >= self.max_attempts:
+            return False
+        due = time.monotonic() + backoff_delay(attempts, self.base_delay, self.max_delay)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), item))
+            self._cond.notify_all()
+        return True
+
+    def pop_due(self):
+        """Retire et retourne les éléments dont le délai est écoulé (sans attendre)"""
+        items = []
+        now = time.monotonic()
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                items.append(heapq.heappop(self._heap)[2])
+        return items
+
+    def next_delay(self):
+        """Secondes avant le prochain élément disponible, None si la file est vide"""
+        with self._cond:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def get(self):
+        """Attend le prochain élément disponible ; retourne None une fois la file fermée"""
+        with self._cond:
+            while not self._closed:
+                if self._heap:
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        return heapq.heappop(self._heap)[2]
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            return None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import streamlit as st
+
+# Chemin commun à tous les processus qui envoient (workers d'autres hôtes compris)
+JOURNAL_PATH = os.environ.get("SEND_JOURNAL_PATH", "send_journal.db")
+# Attente maximale du verrou d'écriture tenu par un autre processus (secondes)
+BUSY_TIMEOUT = 30.0
+
+# Taille des blocs lus pour calculer l'empreinte d'un fichier
+HASH_BLOCK_SIZE = 1024 * 1024
+
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    channels TEXT,
+    created_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    status TEXT NOT NULL,
+    response TEXT,
+    account TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_recipient ON messages (campaign_id, channel, recipient);
+"""
+
+def content_hash(source):
+    """Empreinte SHA-256 du contenu d'un fichier (chemin ou fichier ouvert en binaire), lu par blocs"""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+def make_campaign_id(contacts_hash, *parts):
+    """Identifiant stable d'une campagne (mêmes contacts et mêmes réglages => même identifiant).
+
+    `contacts_hash` est l'empreinte du fichier de contacts (`content_hash`) :
+    l'interface et la ligne de commande obtiennent le même identifiant.
+    """
+    digest = hashlib.sha256()
+    for part in (contacts_hash, *parts):
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+def _filter_contacts(df, column, keys, keep):
+    """Garde les contacts dont la clé est dans `keys` (keep=True) ou hors de `keys` (keep=False)"""
+    mask = df[column].astype(str).str.strip().isin(keys)
+    return df[mask] if keep else df[~mask]
+
+class SendJournal:
+    """Journal des envois en ajout seul (SQLite en mode WAL).
+
+    Chaque message envoyé ou en échec définitif y est enregistré (canal,
+    destinataire, statut, réponse du fournisseur, horodatage). Une campagne
+    interrompue peut ainsi reprendre sans renvoyer aux destinataires déjà
+    atteints, et les échecs peuvent être renvoyés seuls.
+    """
+
+    def __init__(self, path=JOURNAL_PATH, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def start_campaign(self, campaign_id, name, channels):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO campaigns (id, name, channels, created_at) VALUES (?, ?, ?, ?)",
+                (campaign_id, name, ",".join(channels), datetime.now().isoformat())
+            )
+            self._conn.execute("UPDATE campaigns SET finished_at = NULL WHERE id = ?", (campaign_id,))
+            self._conn.commit()
+
+    def finish_campaign(self, campaign_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE campaigns SET finished_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), campaign_id)
+            )
+            self._conn.commit()
+
+    def record(self, campaign_id, channel, rows):
+        """Ajoute des résultats (destinataire, erreur ou None, compte[, ...]) au journal.
+
+        Chaque lot est validé aussitôt : le verrou d'écriture de la base n'est
+        jamais gardé entre deux envois, même espacés (cadence, quota horaire),
+        et les autres processus qui partagent le journal peuvent écrire.
+        """
+        if not rows:
+            return
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO messages (campaign_id, channel, recipient, status, response, account, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (campaign_id, channel, recipient,
+                     STATUS_SENT if error is None else STATUS_FAILED, error, account, now)
+                    for recipient, error, account, *_ in rows
+                ]
+            )
+
+    def flush(self):
+        """Valide ce qui resterait en attente (les lots de `record` le sont déjà)"""
+        with self._lock:
+            self._conn.commit()
+
+    def _latest_status(self, campaign_id, channel, status):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT recipient FROM messages m WHERE campaign_id = ? AND channel = ? "
+                "AND id = (SELECT MAX(id) FROM messages WHERE campaign_id = m.campaign_id "
+                "AND channel = m.channel AND recipient = m.recipient) AND status = ?",
+                (campaign_id, channel, status)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def delivered(self, campaign_id, channel):
+        """Destinataires déjà atteints par la campagne sur ce canal"""
+        return self._latest_status(campaign_id, channel, STATUS_SENT)
+
+    def failed(self, campaign_id, channel):
+        """Destinataires dont le dernier envoi a échoué"""
+        return self._latest_status(campaign_id, channel, STATUS_FAILED)
+
+    def counts(self, campaign_id, channel):
+        """Nombre de destinataires atteints et en échec, d'après le dernier envoi de chacun"""
+        with self._lock:
+            sent, failed = self._conn.execute(
+                "SELECT COALESCE(SUM(status = ?), 0), COALESCE(SUM(status = ?), 0) FROM messages m "
+                "WHERE campaign_id = ? AND channel = ? "
+                "AND id = (SELECT MAX(id) FROM messages WHERE campaign_id = m.campaign_id "
+                "AND channel = m.channel AND recipient = m.recipient)",
+                (STATUS_SENT, STATUS_FAILED, campaign_id, channel)
+            ).fetchone()
+        return {STATUS_SENT: sent, STATUS_FAILED: failed}
+
+    def pending_contacts(self, df, column, campaign_id, channel, failed_only=False):
+        """Contacts restant à envoyer : ceux pas encore atteints, ou seulement ceux en échec"""
+        if df.empty:
+            return df
+        keys = self.failed(campaign_id, channel) if failed_only else self.delivered(campaign_id, channel)
+        return _filter_contacts(df, column, keys, failed_only)
+
+    def pending_chunks(self, chunks, column, campaign_id, channel, failed_only=False):
+        """Version en flux de `pending_contacts` : le journal n'est interrogé qu'une fois"""
+        keys = self.failed(campaign_id, channel) if failed_only else self.delivered(campaign_id, channel)
+        for chunk in chunks:
+            chunk = _filter_contacts(chunk, column, keys, failed_only)
+            if not chunk.empty:
+                yield chunk
+
+    def campaign(self, campaign_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, channels, created_at, finished_at FROM campaigns WHERE id = ?",
+                (campaign_id,)
+            ).fetchone()
+        return dict(zip(("id", "name", "channels", "created_at", "finished_at"), row)) if row else None
+
+    def campaigns(self, limit=50):
+        """Dernières campagnes avec le nombre d'envois réussis et en échec"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.id, c.name, c.channels, c.created_at, c.finished_at, "
+                "COALESCE(SUM(m.status = 'sent'), 0), COALESCE(SUM(m.status = 'failed'), 0) "
+                "FROM campaigns c LEFT JOIN messages m ON m.campaign_id = c.id "
+                # Seul le dernier envoi de chaque destinataire compte
+                "AND m.id IN (SELECT MAX(id) FROM messages GROUP BY campaign_id, channel, recipient) "
+                "GROUP BY c.id ORDER BY c.created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        keys = ("id", "name", "channels", "created_at", "finished_at", "sent", "failed")
+        return [dict(zip(keys, row)) for row in rows]
+
+@st.cache_resource
+def get_send_journal():
+    """Journal partagé par tout le processus Streamlit"""
+    return SendJournal()
@@ -0,0 +1,104 @@
+import queue
+import threading
+
+# Nombre maximal d'éléments en attente entre deux étapes
+DEFAULT_STAGE_QUEUE_SIZE = 100
+# Délai d'attente sur une file avant de revérifier l'arrêt (secondes)
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+class SendPipeline:
+    """Chaîne d'étapes exécutées chacune dans son thread, reliées par des files bornées.
+
+    `source` est un itérable lu dans son propre thread (ingestion). Chaque étape
+    de `stages` reçoit l'itérateur des éléments de l'étape précédente ; les
+    étapes intermédiaires sont des générateurs dont les éléments passent à la
+    suivante, la dernière consomme (transmission) et son retour est ignoré.
+
+    Une file pleine bloque l'étape qui l'alimente : la préparation ne prend
+    jamais plus de `queue_size` éléments d'avance par file sur l'envoi, et la
+    mémoire reste bornée quelle que soit la taille de la campagne. La première
+    erreur d'une étape arrête toute la chaîne et est relancée par `raise_error`.
+    """
+
+    def __init__(self, source, *stages, queue_size=DEFAULT_STAGE_QUEUE_SIZE):
+        self.source = source
+        self.stages = stages
+        # Une file en entrée de chaque étape
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.error = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        workers = [(self._ingest, lambda: None, self.queues[0])]
+        for position, stage in enumerate(self.stages):
+            output = self.queues[position + 1] if position + 1 < len(self.queues) else None
+            workers.append((stage, lambda q=self.queues[position]: self._iter_queue(q), output))
+        for stage, inputs, output in workers:
+            thread = threading.Thread(target=self._run, args=(stage, inputs, output), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Arrêt anticipé : chaque étape termine l'élément en cours puis s'arrête"""
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        """Attend la fin de toutes les étapes ; retourne False si `timeout` est écoulé avant"""
+        for thread in self._threads:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+        return True
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def backlog(self):
+        """Nombre d'éléments en attente dans chaque file (suivi de la contre-pression)"""
+        return [q.qsize() for q in self.queues]
+
+    def _ingest(self, _):
+        for item in self.source:
+            if self._stopped.is_set():
+                return
+            yield item
+
+    def _iter_queue(self, q):
+        while True:
+            try:
+                item = q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            if item is _END or self._stopped.is_set():
+                return
+            yield item
+
+    def _put(self, q, item):
+        while not self._stopped.is_set():
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, stage, inputs, output):
+        try:
+            result = stage(inputs())
+            if output is not None:
+                for item in result:
+                    if not self._put(output, item):
+                        return
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            self._stopped.set()
+        finally:
+            if output is not None:
+                self._put(output, _END)
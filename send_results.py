@@ -0,0 +1,236 @@
+import itertools
+import math
+import re
+import uuid
+from array import array
+from collections.abc import Sequence
+from log_spool import iter_spool, iter_spool_reversed
+
+STATUS_SENT = 1
+STATUS_FAILED = 2
+STATUS_INVALID = 3
+STATUS_NAMES = {STATUS_SENT: "sent", STATUS_FAILED: "failed", STATUS_INVALID: "invalid"}
+
+# Code de réponse SMTP d'un envoi accepté
+SMTP_OK = 250
+
+_REPLY_CODE = re.compile(r"^([2-5]\d\d)\b")
+
+# Lignes de log produites à la demande, par canal et par statut
+LOG_FORMATS = {
+    "email": {
+        STATUS_SENT: "✅ Email envoyé à {recipient}",
+        STATUS_FAILED: "❌ Erreur {recipient}: {error}",
+        STATUS_INVALID: "❌ Email invalide ignoré: {recipient}",
+    },
+    "sms": {
+        STATUS_SENT: "✅ SMS envoyé à {recipient}",
+        STATUS_FAILED: "❌ Erreur avec {recipient}: {error}",
+        STATUS_INVALID: "❌ Numéro invalide ignoré: {recipient}",
+    },
+}
+
+def reply_code(error):
+    """Code de réponse du fournisseur en tête du message d'erreur (ex. "550 ..."), 0 si absent"""
+    match = _REPLY_CODE.match(error or "")
+    return int(match.group(1)) if match else 0
+
+class SendResults:
+    """Résultats d'une campagne en colonnes compactes, un élément par destinataire.
+
+    Rang du contact dans la liste envoyée, statut, code de réponse et latence
+    sont des `array` (quelques octets par destinataire) ; seules les erreurs
+    gardent leur texte. Les adresses ne sont pas gardées en mémoire : elles
+    sont écrites au fil de l'envoi dans le `spool` (log_spool.LogSpool), d'où
+    les lignes de log lisibles sont reconstruites à la lecture (voir `logs`).
+    Les messages généraux (comptes, erreurs globales) sont ajoutés avec `note`.
+    """
+
+    def __init__(self, channel, spool=None, log_path=None, run=None):
+        self.channel = channel
+        self.spool = spool
+        self._log_path = log_path
+        # Identifiant de cet envoi dans le log (un même log peut en contenir plusieurs)
+        self.run = run or uuid.uuid4().hex[:12]
+        self.indexes = array("l")
+        self.status = array("b")
+        self.reply_codes = array("h")
+        self.latencies = array("f")
+        # Texte des erreurs, uniquement pour les destinataires en échec
+        self.errors = {}
+        # Messages généraux avant et après les lignes par destinataire
+        self.head = []
+        self.tail = []
+        # Adresses gardées en mémoire seulement sans log sur disque
+        self._recipients = [] if spool is None and log_path is None else None
+
+    def __len__(self):
+        return len(self.status)
+
+    @property
+    def log_path(self):
+        return self.spool.path if self.spool is not None else self._log_path
+
+    def note(self, message):
+        (self.tail if len(self) else self.head).append(message)
+        if self.spool is not None:
+            self.spool.write(channel=self.channel, note=message)
+
+    def record(self, recipient, status, code=0, latency=None, error=None, index=-1):
+        """Résultat d'un destinataire ; `index` est son rang dans la liste de contacts envoyée"""
+        if self.spool is not None:
+            self.spool.write(
+                channel=self.channel, run=self.run, index=index, recipient=recipient, status=STATUS_NAMES[status],
+                code=code, latency_ms=None if latency is None else round(latency * 1000, 1), error=error
+            )
+        if self._recipients is not None:
+            self._recipients.append(recipient)
+        if error is not None:
+            self.errors[len(self)] = error
+        self.indexes.append(index)
+        self.status.append(status)
+        self.reply_codes.append(code)
+        self.latencies.append(math.nan if latency is None else latency)
+
+    def _own_entries(self, entries):
+        return (entry["recipient"] for entry in entries if entry.get("run") == self.run and "recipient" in entry)
+
+    def recipients_at(self, positions):
+        """Adresses des résultats aux rangs `positions`, relues en remontant le log depuis la fin.
+
+        La lecture s'arrête au plus ancien rang demandé : afficher les
+        dernières lignes ne relit que la fin du log. "?" pour un rang
+        absent (log tronqué par la rotation).
+        """
+        positions = set(positions)
+        if self._recipients is not None:
+            return {position: self._recipients[position] for position in positions}
+        found = {}
+        if positions:
+            oldest = min(positions)
+            recipients = self._own_entries(iter_spool_reversed(self.log_path))
+            for position, recipient in zip(range(len(self) - 1, oldest - 1, -1), recipients):
+                if position in positions:
+                    found[position] = recipient
+        return {position: found.get(position, "?") for position in positions}
+
+    def iter_recipients(self):
+        """Adresses de tous les résultats dans l'ordre, lues en flux depuis le log"""
+        if self._recipients is not None:
+            yield from self._recipients
+            return
+        # Log tronqué par la rotation : les plus anciennes adresses manquent
+        available = sum(1 for _ in self._own_entries(iter_spool(self.log_path)))
+        missing = max(len(self) - available, 0)
+        yield from itertools.repeat("?", missing)
+        yield from itertools.islice(self._own_entries(iter_spool(self.log_path)), len(self) - missing)
+
+    def line(self, index, recipient):
+        """Ligne de log d'un destinataire"""
+        return LOG_FORMATS[self.channel][self.status[index]].format(
+            recipient=recipient, error=self.errors.get(index, "")
+        )
+
+    @property
+    def logs(self):
+        return LazyLogs(self)
+
+    def count(self, status):
+        return self.status.count(status)
+
+    def to_dict(self):
+        """Forme sérialisable en JSON (résultats d'un job) ; les adresses restent dans le log"""
+        data = {
+            "channel": self.channel,
+            "log_path": self.log_path,
+            "run": self.run,
+            "indexes": self.indexes.tolist(),
+            "status": self.status.tolist(),
+            "reply_codes": self.reply_codes.tolist(),
+            "latencies": [None if math.isnan(value) else round(value, 4) for value in self.latencies],
+            "errors": {str(index): error for index, error in self.errors.items()},
+            "head": self.head,
+            "tail": self.tail,
+        }
+        if self._recipients is not None:
+            data["recipients"] = self._recipients
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        results = cls(data["channel"], log_path=data.get("log_path"), run=data.get("run"))
+        if "recipients" in data:
+            results._recipients = data["recipients"]
+        results.indexes = array("l", data.get("indexes") or [-1] * len(data["status"]))
+        results.status = array("b", data["status"])
+        results.reply_codes = array("h", data["reply_codes"])
+        results.latencies = array("f", [math.nan if value is None else value for value in data["latencies"]])
+        results.errors = {int(index): error for index, error in data["errors"].items()}
+        results.head = data["head"]
+        results.tail = data["tail"]
+        return results
+
+class LazyLogs(Sequence):
+    """Lignes de log d'une campagne, fabriquées à la demande (compatible liste : len, [-10:], join).
+
+    Rien n'est gardé en mémoire : seules les adresses des lignes demandées
+    sont relues depuis le log (la fin du log pour `[-10:]`).
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def __len__(self):
+        return len(self.results.head) + len(self.results) + len(self.results.tail)
+
+    def _lines(self, indexes):
+        head, results = self.results.head, self.results
+        recipients = results.recipients_at(
+            index - len(head) for index in indexes if len(head) <= index < len(head) + len(results)
+        )
+        lines = []
+        for index in indexes:
+            if index < len(head):
+                lines.append(head[index])
+            elif index - len(head) < len(results):
+                lines.append(results.line(index - len(head), recipients[index - len(head)]))
+            else:
+                lines.append(results.tail[index - len(head) - len(results)])
+        return lines
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._lines(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._lines([index])[0]
+
+    def __iter__(self):
+        yield from self.results.head
+        for index, recipient in enumerate(self.results.iter_recipients()):
+            yield self.results.line(index, recipient)
+        yield from self.results.tail
+
+def export_campaign_results(campaign_results):
+    """Résultats par canal sérialisables en JSON : colonnes au lieu des lignes de log"""
+    exported = {}
+    for channel, results in campaign_results.items():
+        exported[channel] = {key: value for key, value in results.items() if key not in ("logs", "statuses")}
+        if "statuses" in results:
+            exported[channel]["statuses"] = results["statuses"].to_dict()
+        else:
+            exported[channel]["logs"] = list(results.get("logs", []))
+    return exported
+
+def import_campaign_results(data):
+    """Inverse de `export_campaign_results` : les logs redeviennent disponibles à la demande"""
+    campaign_results = {}
+    for channel, results in data.items():
+        results = dict(results)
+        if "statuses" in results:
+            results["statuses"] = SendResults.from_dict(results["statuses"])
+            results["logs"] = results["statuses"].logs
+        campaign_results[channel] = results
+    return campaign_results
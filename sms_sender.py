@@ -1,65 +1,257 @@
 import streamlit as st
 import pandas as pd
-import re
+import queue
+import threading
+import time
 from datetime import datetime
-from sms_utils import validate_cameroon_phone, format_cameroon_phone, send_sms_orange_cm, send_sms_mtn_cm
+from sms_utils import (
+    OPERATOR_PREFIXES, classify_cameroon_operators, missing_sms_credentials, send_sms_orange_cm, send_sms_mtn_cm
+)
 from sms_manager import load_sms_configs, load_sms_templates, save_sms_campaign
+from template_renderer import compile_template, extract_template_variables
+from contact_manager import (
+    PHONE_COLUMNS, PHONE_VALID, STREAMING_THRESHOLD, resolve_variable_values, count_contacts,
+    iter_contact_chunks, iter_recipient_values, with_phone_columns, channel_contacts, iter_channel_contacts,
+    contact_file_hash, load_contact_file
+)
+from retry_queue import RetryQueue, is_transient_error
+from send_journal import get_send_journal
+from progress_reporter import StreamlitProgress
+from log_spool import open_campaign_spool
+from send_results import SendResults, STATUS_SENT, STATUS_FAILED, reply_code
 
-def send_sms_campaign(df, sms_config, var_mapping, default_values):
-    """Version modulaire pour l'envoi de SMS (utilisée par campaign_manager)"""
+# Morceaux de contacts d'avance par route d'opérateur
+ROUTE_QUEUE_SIZE = 4
+# Intervalle de mise à jour de l'avancement et d'attente des threads (secondes)
+PROGRESS_INTERVAL = 0.1
+
+def send_operator_sms(config_data, phone_number, message):
+    """Envoie un SMS via l'API de l'opérateur configuré ; retourne True si accepté"""
+    if config_data["operator"] == "orange_cm":
+        return send_sms_orange_cm(phone_number, message, config_data)
+    if config_data["operator"] == "mtn_cm":
+        return send_sms_mtn_cm(phone_number, message, config_data)
+    raise ValueError(f"opérateur inconnu: {config_data['operator']}")
+
+def operator_routes(sms_configs, preferred=None):
+    """Configuration utilisée pour chaque opérateur : `preferred` pour le sien, sinon la première enregistrée"""
+    routes = {}
+    for config_data in sms_configs.values():
+        if config_data.get("operator") in OPERATOR_PREFIXES:
+            routes.setdefault(config_data["operator"], config_data)
+    if preferred:
+        routes[sms_configs[preferred]["operator"]] = sms_configs[preferred]
+    return routes
+
+def split_by_route(contacts, routes, default_route):
+    """Contacts d'un morceau regroupés par route d'après le préfixe de leur numéro (un passage vectorisé).
+
+    Les numéros d'un opérateur sans configuration, ou de préfixe inconnu,
+    partent par `default_route`.
+    """
+    operators = classify_cameroon_operators(contacts["telephone"])
+    route = operators.where(operators.isin(list(routes)), default_route)
+    for name, part in contacts.groupby(route.to_numpy(), sort=False):
+        yield name, part
+
+def send_sms_campaign(df, sms_config, var_mapping, default_values, progress=None, total=None):
+    """Version modulaire pour l'envoi de SMS (utilisée par campaign_manager).
+
+    Les échecs de l'opérateur (refus, erreur réseau) sont retentés avec un
+    backoff exponentiel ; les échecs définitifs sont listés dans `dead_letters`.
+    `progress(done, total, message=None, final=False)` reçoit l'avancement
+    (barre Streamlit par défaut, rafraîchie à intervalle limité). `df` peut
+    aussi être un itérable de DataFrames (lecture en flux), avec `total` le
+    nombre de contacts attendu.
+
+    Avec `sms_config["routes"]` ({opérateur: configuration}, voir
+    `operator_routes`), chaque numéro part par la configuration de son
+    opérateur, reconnu à son préfixe ; les routes envoient en parallèle,
+    chacune dans son thread. Sinon tout passe par `config_data`.
+
+    `statuses` (send_results.SendResults) garde le statut, le code de réponse
+    et la latence de chaque destinataire ; `logs` en est une vue lisible
+    produite à la demande.
+    """
     
-    logs, success_count, error_count = [], 0, 0
     config_data = sms_config["config_data"]
     template_data = sms_config["template_data"]
     sms_template = template_data.get("content", "")
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    # Routes par opérateur ; la configuration choisie reste prioritaire pour le sien
+    default_route = config_data["operator"]
+    routes = dict(sms_config.get("routes") or {})
+    routes[default_route] = config_data
     
-    for index, row in df.iterrows():
-        phone_number = row["telephone"]
-        status_text.text(f"📱 Envoi à {phone_number}... ({index + 1}/{len(df)})")
-        
-        # Personnalisation du message
-        personalized_sms = sms_template
+    # Identifiants vérifiés une fois avant l'envoi, plutôt qu'un échec par message
+    for name, route_config in routes.items():
+        missing = missing_sms_credentials(route_config)
+        if missing:
+            raise ValueError(f"configuration SMS {name} incomplète ({', '.join(missing)} manquant)")
+    
+    # Résultats par destinataire en colonnes compactes ; logs lisibles produits à la demande
+    spool = open_campaign_spool(sms_config, "sms")
+    statuses = SendResults("sms", spool)
+    success_count, error_count = 0, 0
+    dead_letters = []
+    
+    # Template compilé une seule fois pour toute la campagne
+    variables = extract_template_variables(sms_template, syntax="sms")
+    compiled_sms = compile_template(sms_template, "sms", variables)
+    
+    progress = progress or StreamlitProgress()
+    
+    total = count_contacts(df) if total is None else total
+    done = 0
+    retried = 0
+    routed = dict.fromkeys(routes, 0)
+    retry_queues = {name: RetryQueue() for name in routes}
+    # Compteurs et résultats partagés entre les threads des routes
+    lock = threading.Lock()
+    
+    # Journal des envois (reprise après interruption, renvoi des échecs)
+    campaign_id = sms_config.get("campaign_id")
+    journal = get_send_journal() if campaign_id else None
+    
+    def attempt(route_config, retries, index, phone_number, personalized_sms, attempts):
+        """Un envoi (contact de rang `index`) ; en cas d'échec temporaire il est replanifié dans `retries`"""
+        nonlocal success_count, error_count, done, retried
+        started = time.monotonic()
+        try:
+            if send_operator_sms(route_config, phone_number, personalized_sms):
+                with lock:
+                    statuses.record(phone_number, STATUS_SENT, latency=time.monotonic() - started, index=index)
+                    success_count += 1
+                    done += 1
+                if journal is not None:
+                    journal.record(campaign_id, "sms", [(phone_number, None, route_config["operator"])])
+                return
+            error, transient = "refusé par l'opérateur", True
+        except Exception as e:
+            error, transient = str(e), is_transient_error(e)
         
-        for var in set(re.findall(r'\{(.*?)\}', sms_template)):
-            if var in var_mapping and var_mapping[var] in row and pd.notna(row[var_mapping[var]]):
-                value = str(row[var_mapping[var]])
-            else:
-                value = default_values.get(var, f"{{{var}}}")
-            
-            personalized_sms = personalized_sms.replace(f"{{{var}}}", value)
+        attempts += 1
+        if transient and retries.schedule((index, phone_number, personalized_sms, attempts), attempts):
+            with lock:
+                retried += 1
+            return
+        if transient:
+            error = f"{error} (abandon après {attempts} tentatives)"
+        with lock:
+            statuses.record(phone_number, STATUS_FAILED, reply_code(error), time.monotonic() - started, error, index)
+            dead_letters.append({"telephone": phone_number, "erreur": error})
+            error_count += 1
+            done += 1
+        if journal is not None:
+            journal.record(campaign_id, "sms", [(phone_number, error, route_config["operator"])])
+    
+    stopped = threading.Event()
+    feeds = {name: queue.Queue(maxsize=ROUTE_QUEUE_SIZE) for name in routes}
+    errors = []
+    
+    def run(target, *args):
+        """Corps d'un thread : la première erreur arrête toutes les routes"""
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+            stopped.set()
+    
+    def dispatch():
+        """Répartit les morceaux de contacts entre les routes ; une file pleine ralentit la lecture"""
+        def put(name, item):
+            while not stopped.is_set():
+                try:
+                    feeds[name].put(item, timeout=PROGRESS_INTERVAL)
+                    return
+                except queue.Full:
+                    continue
         
-        # Envoi du SMS selon l'opérateur
+        position = 0
         try:
-            if config_data["operator"] == "orange_cm":
-                success = send_sms_orange_cm(phone_number, personalized_sms, config_data)
-            elif config_data["operator"] == "mtn_cm":
-                success = send_sms_mtn_cm(phone_number, personalized_sms, config_data)
-            else:
-                success = False
-            
-            if success:
-                logs.append(f"✅ SMS envoyé à {phone_number}")
-                success_count += 1
-            else:
-                logs.append(f"❌ Erreur avec {phone_number}")
-                error_count += 1
+            for chunk in iter_contact_chunks(df):
+                # Index du morceau remplacé par le rang de chaque contact dans la liste envoyée
+                chunk = chunk.set_axis(range(position, position + len(chunk)))
+                position += len(chunk)
+                for name, part in split_by_route(chunk, routes, default_route):
+                    routed[name] += len(part)
+                    put(name, part)
+        finally:
+            for name in routes:
+                put(name, None)
+    
+    def send_route(name):
+        """Envoi des contacts d'une route par la configuration de son opérateur"""
+        route_config, retries, feed = routes[name], retry_queues[name], feeds[name]
+        while not stopped.is_set():
+            try:
+                contacts = feed.get(timeout=PROGRESS_INTERVAL)
+            except queue.Empty:
+                continue
+            if contacts is None:
+                break
+            # Données de personnalisation préparées en un passage vectorisé par morceau de contacts
+            recipients = iter_recipient_values(contacts, "telephone", variables, var_mapping, default_values, fallback="{{{var}}}")
+            for index, (phone_number, values) in zip(contacts.index, recipients):
+                if stopped.is_set():
+                    return
+                # Nouvelles tentatives arrivées à échéance
+                for item in retries.pop_due():
+                    attempt(route_config, retries, *item)
                 
-        except Exception as e:
-            error_msg = f"❌ Erreur avec {phone_number}: {str(e)}"
-            logs.append(error_msg)
-            error_count += 1
+                # Personnalisation du message
+                attempt(route_config, retries, index, phone_number, compiled_sms.render(values), 0)
         
-        progress_bar.progress((index + 1) / len(df))
+        # Dernières tentatives en attente
+        while len(retries) and not stopped.is_set():
+            time.sleep(min(retries.next_delay() or 0, PROGRESS_INTERVAL))
+            for item in retries.pop_due():
+                attempt(route_config, retries, *item)
+    
+    threads = [threading.Thread(target=run, args=(dispatch,), daemon=True)]
+    threads += [threading.Thread(target=run, args=(send_route, name), daemon=True) for name in routes]
+    try:
+        for thread in threads:
+            thread.start()
+        # Avancement affiché depuis ce thread (celui de la page)
+        while any(thread.is_alive() for thread in threads):
+            waiting = sum(len(retries) for retries in retry_queues.values())
+            if waiting and not threads[0].is_alive():
+                progress(done, total, f"🔁 {waiting} SMS en attente de nouvelle tentative...")
+            else:
+                progress(done, total, "📱 Envoi des SMS...")
+            time.sleep(PROGRESS_INTERVAL)
+    finally:
+        # Arrêt de la page : les routes terminent l'envoi en cours puis s'arrêtent
+        if any(thread.is_alive() for thread in threads):
+            stopped.set()
+    
+    if journal is not None:
+        journal.flush()
     
-    status_text.text("✅ Envoi des SMS terminé!")
+    if errors:
+        spool.close()
+        raise errors[0]
+    
+    if len(routes) > 1:
+        statuses.note("📡 Routage par opérateur : " + ", ".join(
+            f"{name} {count}" for name, count in routed.items() if count
+        ))
+    
+    if retried:
+        statuses.note(f"🔁 {retried} nouvelle(s) tentative(s) après échec de l'opérateur")
+    
+    progress(done, total, "✅ Envoi des SMS terminé!", final=True)
+    
+    spool.close()
     
     return {
         "success_count": success_count,
         "error_count": error_count,
-        "logs": logs
+        "logs": statuses.logs,
+        "statuses": statuses,
+        "log_path": spool.path,
+        "dead_letters": dead_letters
     }
 
 def send_sms_section():
@@ -84,43 +276,38 @@ def send_sms_section():
     uploaded_file = st.file_uploader("Fichier CSV des destinataires", type="csv", key="sms_csv")
     
     if uploaded_file and selected_template:
-        df = pd.read_csv(uploaded_file)
+        # Même lecture que la campagne multi-canal : gros fichiers relus en flux à l'envoi
+        streaming = uploaded_file.size > STREAMING_THRESHOLD
+        contact_file = load_contact_file(contact_file_hash(uploaded_file), uploaded_file, streaming)
+        df = contact_file["df"]
         
         if "telephone" not in df.columns:
             st.error("❌ Le CSV doit contenir une colonne 'telephone'")
             return
-            
-        df = df.dropna(subset=["telephone"])
-        df["telephone"] = df["telephone"].astype(str)
         
-        # Validation des numéros
-        valid_numbers = []
-        invalid_numbers = []
+        # Validation des numéros : un seul passage vectorisé, réutilisé à l'envoi
+        df = with_phone_columns(df)
+        total = contact_file["counts"]["sms"]
+        invalid = df[df["telephone"].notna() & ~df[PHONE_VALID]]
         
-        for idx, row in df.iterrows():
-            phone = str(row["telephone"]).strip()
-            if validate_cameroon_phone(phone):
-                valid_numbers.append(format_cameroon_phone(phone))
-            else:
-                invalid_numbers.append({"ligne": idx + 2, "numero": phone})
-        
-        if invalid_numbers:
-            st.warning(f"⚠️ {len(invalid_numbers)} numéro(s) invalide(s) détectés:")
-            invalid_df = pd.DataFrame(invalid_numbers)
+        if not invalid.empty:
+            scope = f" (sur les {len(df)} premières lignes)" if streaming else ""
+            st.warning(f"⚠️ {len(invalid)} numéro(s) invalide(s) détectés{scope}:")
+            invalid_df = pd.DataFrame({"ligne": invalid.index + 2, "numero": invalid["telephone"].astype(str).str.strip()})
             st.dataframe(invalid_df, use_container_width=True)
         
-        if not valid_numbers:
+        if not total:
             st.error("❌ Aucun numéro valide trouvé dans le fichier")
             return
             
-        st.success(f"✅ **{len(valid_numbers)}** numéro(s) camerounais valide(s) trouvé(s)")
+        st.success(f"✅ **{total}** numéro(s) camerounais valide(s) trouvé(s)")
 
         # Charger le template
         template = sms_templates[selected_template]
         sms_template = template.get("content", "")
         
         # Variables détectées
-        variables = set(re.findall(r'\{(.*?)\}', sms_template))
+        variables = extract_template_variables(sms_template, syntax="sms")
         var_mapping, default_values = {}, {}
 
         if variables:
@@ -133,7 +320,7 @@ def send_sms_section():
                         var_mapping[var] = var
                         st.write(f"✔️ `{var}` détecté dans CSV (colonne '{var}')")
                     else:
-                        options = [col for col in df.columns if col not in ['telephone', 'email']]
+                        options = [col for col in df.columns if col not in ['telephone', 'email'] + PHONE_COLUMNS]
                         selected_col = st.selectbox(f"Colonne pour '{var}'", ["(Ignorer)"] + options, key=f"sms_var_{var}")
                         if selected_col != "(Ignorer)":
                             var_mapping[var] = selected_col
@@ -144,16 +331,13 @@ def send_sms_section():
         st.subheader("👀 Aperçu du premier SMS")
         
         preview_sms = sms_template
-        if valid_numbers and not df.empty:
-            first_row = df.iloc[0]
-            
-            for var in variables:
-                if var in var_mapping and var_mapping[var] in first_row and pd.notna(first_row[var_mapping[var]]):
-                    preview_value = str(first_row[var_mapping[var]])
-                else:
-                    preview_value = default_values.get(var, f"{{{var}}}")
-                
-                preview_sms = preview_sms.replace(f"{{{var}}}", preview_value)
+        preview_contacts = channel_contacts(df, "sms")
+        if not preview_contacts.empty:
+            # Même préparation des valeurs que pour l'envoi
+            preview_values = resolve_variable_values(
+                preview_contacts.iloc[:1], variables, var_mapping, default_values, fallback="{{{var}}}"
+            )[0]
+            preview_sms = compile_template(sms_template, "sms", variables).render(preview_values)
 
         st.text_area("Aperçu du message", preview_sms, height=100, disabled=True)
         
@@ -174,11 +358,14 @@ def send_sms_section():
                 "template_data": template
             }
             
-            # Filtrer le dataframe pour garder seulement les numéros valides
-            valid_df = df[df["telephone"].apply(lambda x: validate_cameroon_phone(str(x)))]
-            valid_df["telephone"] = valid_df["telephone"].apply(lambda x: format_cameroon_phone(str(x)))
+            # Seulement les numéros valides, relus en flux pour un gros fichier
+            contacts = iter_channel_contacts(uploaded_file, "sms") if streaming else channel_contacts(df, "sms")
             
-            results = send_sms_campaign(valid_df, sms_config, var_mapping, default_values)
+            try:
+                results = send_sms_campaign(contacts, sms_config, var_mapping, default_values, total=total)
+            except ValueError as e:
+                st.error(f"❌ {str(e)}")
+                return
             
             # Affichage des résultats
             st.subheader("📊 Résultats")
@@ -189,6 +376,6 @@ def send_sms_section():
             # Téléchargement des logs
             st.download_button(
                 "📥 Télécharger les logs",
-                "\n".join(results['logs']),
+                lambda: "\n".join(results['logs']),
                 file_name=f"logs_sms_{datetime.now().strftime('%Y%m%d')}.txt"
             )
\ No newline at end of file
@@ -4,6 +4,7 @@ import json
 import re
 from datetime import datetime
 from sms_manager import load_sms_configs, save_sms_configs, load_sms_templates, save_sms_templates
+from progress_reporter import StreamlitProgress, get_send_logger
 
 def sms_config_section():
     st.header("📱 Configuration SMS - Cameroun")
@@ -42,7 +43,8 @@ def sms_config_section():
             client_id = st.text_input("Client ID Orange", help="Trouvé dans Orange Developer Portal")
             client_secret = st.text_input("Client Secret", type="password")
             sender_name = st.text_input("Nom expéditeur (11 caractères)", max_chars=11, value="NEURAFRIK")
-            api_key = f"{client_id}:{client_secret}"
+            # Les deux identifiants sont obligatoires : sans eux, aucun SMS ne partirait
+            api_key = f"{client_id}:{client_secret}" if client_id and client_secret else ""
             
         elif operator == "mtn_cm":
             st.info("🟡 **MTN Cameroun** - Business SMS API")
@@ -150,11 +152,12 @@ def test_mtn_cm_connection(config):
         st.error(f"Erreur MTN Cameroon: {str(e)}")
         return False
 
+# Formats acceptés: 6XXXXXXXX, 2376XXXXXXXX, +2376XXXXXXXX (le groupe capture le numéro local)
+CAMEROON_PHONE_PATTERN = r'^(?:\+?237)?([6-7][0-9]{8})$'
+
 def validate_cameroon_phone(phone):
     """Valide un numéro de téléphone camerounais"""
-    # Formats acceptés: 6XXXXXXXX, 2376XXXXXXXX, +2376XXXXXXXX
-    pattern = r'^(\+237|237)?[6-7][0-9]{8}$'
-    return re.match(pattern, phone.replace(' ', '')) is not None
+    return re.match(CAMEROON_PHONE_PATTERN, phone.replace(' ', '')) is not None
 
 def format_cameroon_phone(phone):
     """Formate un numéro camerounais au format international"""
@@ -166,6 +169,28 @@ def format_cameroon_phone(phone):
     else:
         return phone
 
+def normalize_cameroon_phones(phones):
+    """Valide et formate toute une colonne de numéros en un seul passage vectorisé.
+
+    Retourne deux séries alignées sur `phones` : le numéro au format
+    international (+2376XXXXXXXX, NaN si invalide) et sa validité.
+    """
+    cleaned = phones.astype(str).str.strip().str.replace(' ', '', regex=False)
+    local = cleaned.str.extract(CAMEROON_PHONE_PATTERN, expand=False)
+    return '+237' + local, local.notna()
+
+# Préfixes (3 premiers chiffres du numéro local) attribués à chaque opérateur
+OPERATOR_PREFIXES = {
+    "orange_cm": [f"69{digit}" for digit in range(10)] + [f"65{digit}" for digit in range(5, 10)],
+    "mtn_cm": [f"67{digit}" for digit in range(10)] + [f"68{digit}" for digit in range(10)] + [f"65{digit}" for digit in range(5)],
+}
+# Table préfixe -> opérateur, calculée une fois au chargement
+PREFIX_OPERATORS = {prefix: operator for operator, prefixes in OPERATOR_PREFIXES.items() for prefix in prefixes}
+
+def classify_cameroon_operators(phones):
+    """Opérateur de chaque numéro au format international (+2376XXXXXXXX) d'après son préfixe, NaN si inconnu"""
+    return phones.astype(str).str[4:7].map(PREFIX_OPERATORS)
+
 def sms_template_section():
     st.header("📝 Gestion des Templates SMS - Cameroun")
     
@@ -333,12 +358,15 @@ def send_sms_section():
         elif import_option == "Fichier CSV":
             uploaded_file = st.file_uploader("Importer un CSV avec colonne 'telephone'", type=['csv'])
             if uploaded_file:
-                # Implémentation basique du parsing CSV
+                # Seule la colonne 'telephone' est lue, par morceaux (import local : contact_manager dépend de ce module)
                 import pandas as pd
+                from contact_manager import read_contact_chunks
                 try:
-                    df = pd.read_csv(uploaded_file)
-                    if 'telephone' in df.columns:
-                        phone_numbers = [format_cameroon_phone(str(num)) for num in df['telephone'] if validate_cameroon_phone(str(num))]
+                    if 'telephone' in pd.read_csv(uploaded_file, nrows=0).columns:
+                        phone_numbers = []
+                        for chunk in read_contact_chunks(uploaded_file, usecols=['telephone']):
+                            phone_e164, phone_valid = normalize_cameroon_phones(chunk['telephone'])
+                            phone_numbers.extend(phone_e164[phone_valid].tolist())
                         st.success(f"✅ {len(phone_numbers)} numéro(s) valide(s) importé(s)")
                     else:
                         st.error("❌ Colonne 'telephone' non trouvée dans le CSV")
@@ -371,22 +399,28 @@ def send_sms_section():
                 st.error("❌ Message trop long! Maximum 160 caractères.")
                 return
             
-            # Simulation d'envoi
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+            missing = missing_sms_credentials(config)
+            if missing:
+                st.error(f"❌ Configuration {operator_name} incomplète ({', '.join(missing)}) : corrigez-la avant l'envoi.")
+                return
+            
+            # Simulation d'envoi (page rafraîchie à intervalle limité, détail dans le journal d'envoi)
+            progress = StreamlitProgress()
             
             success_count = 0
             failed_numbers = []
             
             for i, phone in enumerate(phone_numbers):
-                status_text.text(f"Envoi à {phone}... ({i+1}/{len(phone_numbers)})")
-                
                 # Envoi réel selon l'opérateur
-                if config["operator"] == "orange_cm":
-                    success = send_sms_orange_cm(phone, message_content, config)
-                elif config["operator"] == "mtn_cm":
-                    success = send_sms_mtn_cm(phone, message_content, config)
-                else:
+                try:
+                    if config["operator"] == "orange_cm":
+                        success = send_sms_orange_cm(phone, message_content, config)
+                    elif config["operator"] == "mtn_cm":
+                        success = send_sms_mtn_cm(phone, message_content, config)
+                    else:
+                        success = False
+                except Exception as e:
+                    get_send_logger().error(f"Erreur {operator_name} ({phone}): {str(e)}")
                     success = False
                 
                 if success:
@@ -394,7 +428,9 @@ def send_sms_section():
                 else:
                     failed_numbers.append(phone)
                 
-                progress_bar.progress((i + 1) / len(phone_numbers))
+                progress(i + 1, len(phone_numbers), f"📱 Envoi via {operator_name}...")
+            
+            progress(len(phone_numbers), len(phone_numbers), "✅ Envoi terminé", final=True)
             
             # Résultats
             st.success(f"✅ **{success_count}/{len(phone_numbers)}** SMS envoyés avec succès!")
@@ -405,74 +441,80 @@ def send_sms_section():
                     for failed in failed_numbers:
                         st.write(f"`{failed}`")
 
+def missing_sms_credentials(config):
+    """Identifiants manquants d'une configuration SMS (liste vide si elle est complète)"""
+    if config.get("operator") == "orange_cm":
+        return [field for field in ("client_id", "client_secret") if not config.get(field)]
+    if config.get("operator") == "mtn_cm":
+        return [] if config.get("api_key") else ["api_key"]
+    return []
+
 def send_sms_orange_cm(phone_number: str, message: str, config: dict) -> bool:
-    """Envoi SMS via Orange Cameroon API"""
-    try:
-        # IMPLÉMENTATION RÉELLE POUR ORANGE CAMEROON
-        client_id = config.get("client_id", "")
-        client_secret = config.get("client_secret", "")
-        sender_name = config.get("sender_name", "NEURAFRIK")
-        
-        # ÉTAPE 1: Obtenir le token OAuth2
-        auth_url = "https://api.orange.com/oauth/v3/token"
-        auth_data = {
-            "grant_type": "client_credentials"
-        }
-        auth_headers = {
-            "Authorization": f"Basic {client_id}:{client_secret}",
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        
-        # ÉTAPE 2: Envoyer le SMS
-        sms_url = "https://api.orange.com/smsmessaging/v1/outbound/tel:+237/requests"
-        sms_headers = {
-            "Authorization": f"Bearer VOTRE_TOKEN_ICI",
-            "Content-Type": "application/json"
-        }
-        sms_data = {
-            "outboundSMSMessageRequest": {
-                "address": f"tel:+{phone_number}",
-                "senderAddress": f"tel:+237{sender_name}",
-                "outboundSMSTextMessage": {
-                    "message": message
-                }
+    """Envoi SMS via Orange Cameroon API.
+
+    Les erreurs remontent à l'appelant, qui distingue échecs temporaires
+    (réseau, 429, 5xx) et définitifs (configuration, requête refusée).
+    """
+    # IMPLÉMENTATION RÉELLE POUR ORANGE CAMEROON
+    client_id = config.get("client_id", "")
+    client_secret = config.get("client_secret", "")
+    sender_name = config.get("sender_name", "NEURAFRIK")
+    if not client_id or not client_secret:
+        raise ValueError("configuration Orange incomplète (client_id / client_secret manquant)")
+    
+    # ÉTAPE 1: Obtenir le token OAuth2
+    auth_url = "https://api.orange.com/oauth/v3/token"
+    auth_data = {
+        "grant_type": "client_credentials"
+    }
+    auth_headers = {
+        "Authorization": f"Basic {client_id}:{client_secret}",
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+    
+    # ÉTAPE 2: Envoyer le SMS
+    sms_url = "https://api.orange.com/smsmessaging/v1/outbound/tel:+237/requests"
+    sms_headers = {
+        "Authorization": f"Bearer VOTRE_TOKEN_ICI",
+        "Content-Type": "application/json"
+    }
+    sms_data = {
+        "outboundSMSMessageRequest": {
+            "address": f"tel:+{phone_number}",
+            "senderAddress": f"tel:+237{sender_name}",
+            "outboundSMSTextMessage": {
+                "message": message
             }
         }
-        
-        # Pour l'instant, simulation
-        st.write(f"🟠 [SIMULATION] SMS Orange à {phone_number}: {message[:50]}...")
-        return True
-        
-    except Exception as e:
-        st.error(f"Erreur Orange Cameroon: {str(e)}")
-        return False
+    }
+    
+    # Pour l'instant, simulation
+    get_send_logger().info(f"🟠 [SIMULATION] SMS Orange à {phone_number}: {message[:50]}...")
+    return True
 
 def send_sms_mtn_cm(phone_number: str, message: str, config: dict) -> bool:
-    """Envoi SMS via MTN Cameroon API"""
-    try:
-        # IMPLÉMENTATION RÉELLE POUR MTN CAMEROON
-        api_key = config["api_key"]
-        subscription_id = config.get("subscription_id", "")
-        sender_name = config.get("sender_name", "")
-        
-        # URL de l'API MTN Cameroon
-        mtn_url = f"https://api.mtn.cm/sms/v1/subscriptions/{subscription_id}/messages"
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "to": phone_number,
-            "from": sender_name,
-            "message": message
-        }
-        
-        # Pour l'instant, simulation
-        st.write(f"🟡 [SIMULATION] SMS MTN à {phone_number}: {message[:50]}...")
-        return True
-        
-    except Exception as e:
-        st.error(f"Erreur MTN Cameroon: {str(e)}")
-        return False
\ No newline at end of file
+    """Envoi SMS via MTN Cameroon API (les erreurs remontent à l'appelant, voir `send_sms_orange_cm`)"""
+    # IMPLÉMENTATION RÉELLE POUR MTN CAMEROON
+    api_key = config.get("api_key")
+    if not api_key:
+        raise ValueError("configuration MTN incomplète (clé API manquante)")
+    subscription_id = config.get("subscription_id", "")
+    sender_name = config.get("sender_name", "")
+    
+    # URL de l'API MTN Cameroon
+    mtn_url = f"https://api.mtn.cm/sms/v1/subscriptions/{subscription_id}/messages"
+    
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    
+    data = {
+        "to": phone_number,
+        "from": sender_name,
+        "message": message
+    }
+    
+    # Pour l'instant, simulation
+    get_send_logger().info(f"🟡 [SIMULATION] SMS MTN à {phone_number}: {message[:50]}...")
+    return True
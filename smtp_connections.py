@@ -0,0 +1,113 @@
+import smtplib
+import threading
+import time
+import streamlit as st
+from smtp_pool import get_max_connections
+from smtp_transport import create_tls_context, open_smtp_connection
+
+# Intervalle des NOOP envoyés aux connexions inactives (secondes)
+HEARTBEAT_INTERVAL = 30
+# Au-delà de cette durée d'inactivité, la connexion est fermée (secondes)
+MAX_IDLE_TIME = 600
+
+def _config_key(smtp_config):
+    return (smtp_config["server"], int(smtp_config["port"]), smtp_config["email"], smtp_config.get("password"))
+
+class SMTPConnectionManager:
+    """Connexions SMTP authentifiées conservées entre les reruns et les campagnes.
+
+    Les connexions rendues après usage restent ouvertes (dans la limite de
+    `max_connections` par configuration), maintenues en vie par des NOOP
+    périodiques, et sont réutilisées par l'envoi suivant. Les nouvelles
+    connexions reprennent la session TLS de la précédente.
+    """
+
+    def __init__(self, heartbeat_interval=HEARTBEAT_INTERVAL, max_idle_time=MAX_IDLE_TIME):
+        self.heartbeat_interval = heartbeat_interval
+        self.max_idle_time = max_idle_time
+        self._idle = {}
+        self._contexts = {}
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._heartbeat, daemon=True)
+        thread.start()
+
+    def acquire(self, smtp_config):
+        """Retourne une connexion authentifiée, chaude si possible"""
+        key = _config_key(smtp_config)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    if key not in self._contexts:
+                        self._contexts[key] = create_tls_context()
+                    context = self._contexts[key]
+                    break
+                server, _, last_checked = idle.pop()
+            # Connexion non vérifiée depuis le dernier heartbeat : on contrôle avec un NOOP
+            if time.monotonic() - last_checked < self.heartbeat_interval or self._is_alive(server):
+                return server
+            self._close(server)
+        return open_smtp_connection(smtp_config, context)
+
+    def release(self, smtp_config, server):
+        """Rend une connexion au gestionnaire pour un usage ultérieur"""
+        if server is None:
+            return
+        if getattr(server, "sock", None) is None:
+            return
+        key = _config_key(smtp_config)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < get_max_connections(smtp_config):
+                now = time.monotonic()
+                idle.append((server, now, now))
+                return
+        self._close(server)
+
+    def discard(self, server):
+        """Ferme une connexion dont l'état n'est plus sûr"""
+        if server is not None:
+            self._close(server)
+
+    def idle_count(self, smtp_config):
+        with self._lock:
+            return len(self._idle.get(_config_key(smtp_config), []))
+
+    def _is_alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            with self._lock:
+                # On sort les connexions à vérifier pour ne pas bloquer les envois pendant les NOOP
+                due = []
+                for key, idle in self._idle.items():
+                    keep = []
+                    for entry in idle:
+                        if now - entry[2] >= self.heartbeat_interval:
+                            due.append((key, entry))
+                        else:
+                            keep.append(entry)
+                    idle[:] = keep
+            for key, (server, last_used, _) in due:
+                if now - last_used > self.max_idle_time or not self._is_alive(server):
+                    self._close(server)
+                    continue
+                with self._lock:
+                    self._idle.setdefault(key, []).append((server, last_used, time.monotonic()))
+
+@st.cache_resource
+def get_connection_manager():
+    """Gestionnaire de connexions partagé par tout le processus Streamlit"""
+    return SMTPConnectionManager()
@@ -0,0 +1,416 @@
+import queue
+import smtplib
+import threading
+import time
+from adaptive_control import AdaptiveController, THROTTLE_CODES
+from mime_builder import encode_header
+from rate_limiter import QuotaExceeded
+from retry_queue import RetryQueue, is_transient_error
+from smtp_transport import open_smtp_connection, send_message
+
+# Nombre de connexions simultanées par défaut pour une configuration SMTP
+DEFAULT_MAX_CONNECTIONS = 4
+# Nombre maximal de destinataires (RCPT TO) par message accepté par défaut
+DEFAULT_MAX_RECIPIENTS = 50
+
+# Codes SMTP qui signalent un problème du compte (quota, limite, service) et non du destinataire
+ACCOUNT_ERROR_CODES = {421, 454}
+ACCOUNT_ERROR_HINTS = ("quota", "limit", "too many", "5.4.5", "4.7.0", "rate")
+
+_STOP = object()
+# Attente maximale des envois en cours lors d'un arrêt anticipé (secondes)
+ABORT_TIMEOUT = 10.0
+
+def _has_throttle_codes(refused):
+    """Indique si des destinataires ont été refusés par une réponse de limitation (4xx)"""
+    return any(code in THROTTLE_CODES for code, _ in (refused or {}).values())
+
+def _is_connection_error(error):
+    """Connexion perdue ou réseau en échec (coupure, reset, délai dépassé)"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+def get_max_connections(smtp_config, max_connections=None):
+    """Nombre de connexions à ouvrir pour une configuration (au moins 1)"""
+    value = max_connections or smtp_config.get("max_connections") or DEFAULT_MAX_CONNECTIONS
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_CONNECTIONS
+
+def get_max_recipients(smtp_config):
+    """Nombre maximal de destinataires par message pour une configuration"""
+    try:
+        return max(1, int(smtp_config.get("max_recipients") or DEFAULT_MAX_RECIPIENTS))
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_RECIPIENTS
+
+def is_account_error(error):
+    """Indique si l'erreur concerne le compte SMTP (auth, quota, connexion) plutôt que le destinataire"""
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPServerDisconnected,
+                          smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return False
+        if getattr(error, "smtp_code", None) in ACCOUNT_ERROR_CODES:
+            return True
+        if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+            reply = str(getattr(error, "smtp_error", b"") or b"").lower()
+            return any(hint in reply for hint in ACCOUNT_ERROR_HINTS)
+        return False
+    # Erreurs réseau (socket, timeout)
+    return isinstance(error, OSError)
+
+class SMTPAccount:
+    """Un compte SMTP du pool avec sa propre file de messages"""
+
+    def __init__(self, name, smtp_config, weight=None, max_connections=None):
+        self.name = name
+        self.config = smtp_config
+        self.weight = max(1, int(weight or smtp_config.get("weight") or 1))
+        self.max_connections = get_max_connections(smtp_config, max_connections)
+        self.jobs = None
+        self.alive = 0
+        self.dead = False
+        self.sent = 0
+        self.from_header = encode_header("From", smtp_config["email"])
+        # Limiteur de cadence et de quotas (rate_limiter), None si le compte n'a pas de limite
+        self.limiter = None
+        # Régulation AIMD des envois simultanés et du débit selon les réponses du serveur
+        self.controller = AdaptiveController(self.max_connections)
+        # Compteur du round-robin pondéré
+        self.current_weight = 0
+
+class SMTPWorkerPool:
+    """Pool de connexions SMTP authentifiées réparties sur un ou plusieurs comptes.
+
+    Les messages sont répartis entre les comptes selon leur poids (round-robin
+    pondéré). Chaque worker ouvre sa propre connexion puis consomme la file de
+    son compte. Si un compte tombe (authentification, quota, connexion), ses
+    messages restants sont redirigés vers les autres comptes.
+
+    Avec un `connections` (SMTPConnectionManager), les connexions sont empruntées
+    au gestionnaire puis rendues à la fin au lieu d'être ouvertes et fermées.
+
+    Avec un `quotas` (SendQuotaStore), chaque compte respecte sa cadence et ses
+    quotas horaire/journalier ; un compte dont le quota du jour est atteint est
+    désactivé et ses messages passent aux autres comptes.
+
+    Le nombre d'envois simultanés et le débit de chaque compte s'ajustent en
+    cours de campagne (adaptive_control) : ils augmentent tant que le serveur
+    répond proprement et diminuent sur 421/450/451/452 ou si la latence monte.
+
+    Les échecs temporaires (4xx, coupure, délai dépassé) repassent par une file
+    de nouvelles tentatives (backoff exponentiel avec jitter) ; les échecs
+    définitifs (5xx, tentatives épuisées) sont listés dans `dead_letters`.
+
+    Les résultats sont remontés dans `results` sous la forme (email, erreur, compte,
+    latence), un par destinataire, où erreur vaut None en cas de succès et latence
+    (secondes) None si le message n'a pas abouti à une réponse du serveur.
+    """
+
+    def __init__(self, accounts, max_connections=None, queue_size=None, connections=None, quotas=None):
+        # Compatibilité : une seule configuration SMTP
+        if isinstance(accounts, dict):
+            accounts = [{"name": accounts.get("email", "smtp"), "config": accounts}]
+        self.accounts = [
+            SMTPAccount(a["name"], a["config"], a.get("weight"), max_connections)
+            for a in accounts
+        ]
+        for account in self.accounts:
+            # File bornée : le thread principal ne prend pas trop d'avance sur l'envoi
+            account.jobs = queue.Queue(maxsize=queue_size or account.max_connections * 20)
+            if quotas is not None:
+                account.limiter = quotas.limiter(account.config)
+        self.max_connections = sum(a.max_connections for a in self.accounts)
+        # Gestionnaire de connexions persistantes (smtp_connections), facultatif
+        self.connections = connections
+        # Compteurs d'envoi persistants (rate_limiter), facultatifs
+        self.quotas = quotas
+        self.results = queue.Queue()
+        self.errors = []
+        # Nouvelles tentatives planifiées et échecs définitifs (email, erreur, compte)
+        self.retries = RetryQueue()
+        self.dead_letters = []
+        self.retried = 0
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+        self._aborted = threading.Event()
+
+    def start(self):
+        for account in self.accounts:
+            account.alive = account.max_connections
+            for _ in range(account.max_connections):
+                thread = threading.Thread(target=self._worker, args=(account,), daemon=True)
+                thread.start()
+                self._threads.append((account, thread))
+        self._scheduler_thread = threading.Thread(target=self._scheduler, daemon=True)
+        self._scheduler_thread.start()
+
+    def submit(self, recipients, message):
+        """Ajoute un message (octets, sans en-tête From) à la file d'un compte (bloque si elle est pleine).
+
+        `recipients` est une adresse ou une liste d'adresses (enveloppe RCPT TO multiple).
+        """
+        if self._aborted.is_set():
+            return
+        if isinstance(recipients, str):
+            recipients = (recipients,)
+        with self._lock:
+            self._pending += 1
+        self._dispatch((tuple(recipients), message, 0))
+
+    def close(self):
+        """Attend l'envoi de tous les messages puis arrête les workers"""
+        if self._closed:
+            return
+        self._closed = True
+        # Attendre que les messages redirigés ou retentés aient tous été traités avant d'arrêter
+        with self._idle:
+            while self._pending > 0 and not self._aborted.is_set():
+                self._idle.wait()
+        if self._aborted.is_set():
+            # Arrêt déjà pris en charge par `abort`
+            return
+        self.retries.close()
+        self._scheduler_thread.join()
+        for account, _ in self._threads:
+            account.jobs.put(_STOP)
+        for _, thread in self._threads:
+            thread.join()
+
+    def abort(self, timeout=ABORT_TIMEOUT):
+        """Arrêt anticipé : les messages encore en file ou à retenter ne sont pas envoyés.
+
+        Les envois en cours se terminent (au plus `timeout` secondes d'attente) ;
+        leurs résultats restent disponibles par `drain`.
+        """
+        self._aborted.set()
+        with self._idle:
+            self._idle.notify_all()
+        self.retries.close()
+        for account in self.accounts:
+            while True:
+                try:
+                    account.jobs.get_nowait()
+                except queue.Empty:
+                    break
+        for account, _ in self._threads:
+            account.jobs.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for _, thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def drain(self):
+        """Retourne les résultats disponibles sans bloquer"""
+        items = []
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _pick_account(self, exclude=None):
+        """Round-robin pondéré (lissé) sur les comptes encore actifs"""
+        with self._lock:
+            candidates = [a for a in self.accounts if not a.dead and a is not exclude]
+            if not candidates:
+                return None
+            total = sum(a.weight for a in candidates)
+            for account in candidates:
+                account.current_weight += account.weight
+            chosen = max(candidates, key=lambda a: a.current_weight)
+            chosen.current_weight -= total
+            return chosen
+
+    def _dispatch(self, job, exclude=None, reason=None):
+        account = self._pick_account(exclude)
+        if account is None:
+            recipients = job[0]
+            self._report(recipients, None, f"aucun compte SMTP disponible ({reason or 'connexion SMTP indisponible'})")
+            return
+        account.jobs.put(job)
+
+    def _report(self, recipients, account, error=None, refused=None, done=True, latency=None):
+        """Remonte le résultat d'un message pour chacun de ses destinataires.
+
+        Avec `done=False` le message reste en cours (une partie des destinataires
+        est retentée).
+        """
+        name = account.name if account else None
+        for email_dest in recipients:
+            if error is not None:
+                self._fail(email_dest, error, name, latency)
+            elif refused and email_dest in refused:
+                code, reply = refused[email_dest]
+                self._fail(email_dest, f"{code} {reply.decode(errors='replace')}", name, latency)
+            else:
+                account.sent += 1
+                self.results.put((email_dest, None, name, latency))
+        if not done:
+            return
+        with self._idle:
+            self._pending -= 1
+            if self._pending <= 0:
+                self._idle.notify_all()
+
+    def _fail(self, email_dest, error, name, latency=None):
+        with self._lock:
+            self.dead_letters.append((email_dest, error, name))
+        self.results.put((email_dest, error, name, latency))
+
+    def _complete(self, job, account, refused, latency=None):
+        """Message accepté : les destinataires refusés temporairement (4xx) sont retentés"""
+        recipients, message, attempts = job
+        retry = tuple(r for r in recipients if r in refused and 400 <= refused[r][0] < 500)
+        if not retry:
+            self._report(recipients, account, refused=refused, latency=latency)
+            return
+        self._report([r for r in recipients if r not in retry], account, refused=refused, done=False, latency=latency)
+        code, reply = refused[retry[0]]
+        self._retry((retry, message, attempts), account, f"{code} {reply.decode(errors='replace')}")
+
+    def _retry(self, job, account, error):
+        """Replanifie un message après un échec temporaire, ou le classe en échec définitif"""
+        recipients, message, attempts = job
+        attempts += 1
+        if self.retries.schedule((recipients, message, attempts), attempts):
+            with self._lock:
+                self.retried += len(recipients)
+            return
+        self._report(recipients, account, f"{error} (abandon après {attempts} tentatives)")
+
+    def _scheduler(self):
+        """Remet en file les messages dont le délai de nouvelle tentative est écoulé"""
+        while True:
+            job = self.retries.get()
+            if job is None:
+                return
+            self._dispatch(job, reason="nouvelle tentative impossible")
+
+    def _disable(self, account, error):
+        """Désactive un compte ; ses workers redirigent alors leurs messages"""
+        with self._lock:
+            if account.dead:
+                return
+            account.dead = True
+            self.errors.append(f"{account.name}: {error}")
+
+    def _connect(self, account):
+        if self.connections is not None:
+            return self.connections.acquire(account.config)
+        return open_smtp_connection(account.config)
+
+    def _disconnect(self, account, server, reusable=True):
+        if server is None:
+            return
+        if self.connections is not None:
+            if reusable:
+                self.connections.release(account.config, server)
+            else:
+                self.connections.discard(server)
+            return
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _worker(self, account):
+        server = None
+        try:
+            server = self._connect(account)
+        except Exception as e:
+            if not self._worker_failed(account, e):
+                # D'autres connexions du compte restent actives
+                return
+
+        try:
+            while True:
+                job = account.jobs.get()
+                if job is _STOP:
+                    break
+                if self._aborted.is_set():
+                    continue
+                if account.dead or server is None:
+                    self._dispatch(job, exclude=account, reason=f"compte {account.name} indisponible")
+                    continue
+                recipients = job[0]
+                if account.limiter is not None:
+                    try:
+                        # Attend la cadence du compte ; chaque destinataire compte dans le quota
+                        account.limiter.acquire(len(recipients))
+                    except QuotaExceeded as e:
+                        self._disable(account, e)
+                        self._dispatch(job, exclude=account, reason=str(e))
+                        continue
+                    if self._aborted.is_set():
+                        continue
+                message = account.from_header + job[1]
+                controller = account.controller
+                # Une connexion perdue est rouverte et le message renvoyé aussitôt, une fois ;
+                # les autres échecs temporaires passent par la file de nouvelles tentatives
+                reconnected = False
+                while True:
+                    controller.acquire()
+                    started = time.monotonic()
+                    latency, congested = None, False
+                    try:
+                        refused = send_message(server, account.config["email"], recipients, message)
+                        latency = time.monotonic() - started
+                        congested = _has_throttle_codes(refused)
+                        self._complete(job, account, refused, latency)
+                    except smtplib.SMTPRecipientsRefused as e:
+                        latency = time.monotonic() - started
+                        congested = _has_throttle_codes(e.recipients)
+                        self._complete(job, account, e.recipients, latency)
+                    except Exception as e:
+                        if _is_connection_error(e):
+                            self._disconnect(account, server, reusable=False)
+                            try:
+                                server = self._connect(account)
+                            except Exception as reconnect_error:
+                                server = None
+                                last_worker = self._worker_failed(account, reconnect_error)
+                                self._retry(job, account, reconnect_error)
+                                if not last_worker:
+                                    return
+                                break
+                            if not reconnected:
+                                reconnected = True
+                                continue
+                            self._retry(job, account, e)
+                        elif getattr(e, "smtp_code", None) in THROTTLE_CODES:
+                            # Le serveur demande de ralentir : pause du compte puis nouvelle tentative
+                            congested = True
+                            controller.throttled()
+                            self._retry(job, account, e)
+                        elif is_account_error(e):
+                            self._disable(account, e)
+                            self._dispatch(job, exclude=account, reason=str(e))
+                        elif is_transient_error(e):
+                            self._retry(job, account, e)
+                        else:
+                            self._report(recipients, account, str(e))
+                    finally:
+                        controller.release(latency, congested)
+                    break
+        finally:
+            self._disconnect(account, server)
+
+    def _worker_failed(self, account, error):
+        """Un worker a perdu sa connexion ; sans worker valide le compte est désactivé.
+
+        Retourne True si ce worker était le dernier du compte : il reste alors
+        actif pour rediriger les messages de la file vers les autres comptes.
+        """
+        with self._lock:
+            account.alive -= 1
+            last_worker = account.alive == 0
+        if last_worker:
+            self._disable(account, error)
+        return last_worker
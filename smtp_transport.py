@@ -0,0 +1,129 @@
+import re
+import smtplib
+import ssl
+
+CRLF = b"\r\n"
+SMTP_TIMEOUT = 60
+_LEADING_PERIOD = re.compile(br'(?m)^\.')
+
+def _quote_periods(message):
+    """Double les points en début de ligne (transparence SMTP pour DATA)"""
+    return _LEADING_PERIOD.sub(b"..", message)
+
+class ResumableTLSContext(ssl.SSLContext):
+    """Contexte TLS qui reprend la dernière session négociée (handshake abrégé)"""
+
+    tls_session = None
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.tls_session is not None:
+            kwargs.setdefault("session", self.tls_session)
+        return super().wrap_socket(sock, *args, **kwargs)
+
+def create_tls_context():
+    """Équivalent de `ssl.create_default_context()` avec reprise de session"""
+    context = ResumableTLSContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_default_certs()
+    return context
+
+def open_smtp_connection(smtp_config, context=None):
+    """Ouvre une connexion SMTP authentifiée (STARTTLS + LOGIN).
+
+    Avec un `ResumableTLSContext`, la session TLS obtenue est mémorisée dans le
+    contexte pour être reprise par les connexions suivantes.
+    """
+    context = context or ssl.create_default_context()
+    server = smtplib.SMTP(smtp_config["server"], smtp_config["port"], timeout=SMTP_TIMEOUT)
+    try:
+        server.starttls(context=context)
+        server.login(smtp_config["email"], smtp_config["password"])
+    except Exception:
+        server.close()
+        raise
+    if isinstance(context, ResumableTLSContext):
+        session = getattr(server.sock, "session", None)
+        if session is not None:
+            context.tls_session = session
+    return server
+
+def get_mail_options(server, message, include_size=True):
+    """Options ESMTP de MAIL FROM selon les extensions annoncées par le serveur"""
+    options = []
+    if include_size and server.has_extn("size"):
+        options.append(f"SIZE={len(message)}")
+    if not message.isascii() and server.has_extn("8bitmime"):
+        options.append("BODY=8BITMIME")
+    return options
+
+def send_message(server, from_addr, recipients, message):
+    """Envoie un message en octets (CRLF) à une liste de destinataires.
+
+    Si le serveur annonce PIPELINING, MAIL FROM, tous les RCPT TO et DATA (ou
+    BDAT si CHUNKING est annoncé) partent en une seule écriture, puis les
+    réponses sont lues dans l'ordre et rattachées à chaque destinataire. Sinon
+    on retombe sur `sendmail`. Même contrat que `smtplib.SMTP.sendmail` :
+    retourne le dictionnaire des destinataires refusés et lève les mêmes
+    exceptions.
+    """
+    server.ehlo_or_helo_if_needed()
+    if not server.has_extn("pipelining"):
+        # sendmail ajoute lui-même SIZE
+        mail_options = get_mail_options(server, message, include_size=False) if server.does_esmtp else []
+        return server.sendmail(from_addr, recipients, message, mail_options)
+
+    mail_options = get_mail_options(server, message)
+
+    chunking = server.has_extn("chunking")
+    options = "".join(" " + option for option in mail_options)
+    commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}\r\n".encode()]
+    for recipient in recipients:
+        commands.append(f"RCPT TO:{smtplib.quoteaddr(recipient)}\r\n".encode())
+    if chunking:
+        # BDAT : pas de transparence à gérer ni d'attente de la réponse 354
+        commands.append(f"BDAT {len(message)} LAST\r\n".encode())
+        commands.append(message)
+    else:
+        commands.append(b"DATA\r\n")
+    server.send(b"".join(commands))
+
+    # Lecture des réponses dans l'ordre des commandes envoyées
+    mail_code, mail_reply = server.getreply()
+    refused = {}
+    for recipient in recipients:
+        code, reply = server.getreply()
+        if code not in (250, 251):
+            refused[recipient] = (code, reply)
+    data_code, data_reply = server.getreply()
+
+    if not chunking and data_code == 354:
+        if mail_code != 250 or len(refused) == len(recipients):
+            # Le serveur accepte DATA sans transaction valide : message vide
+            server.send(b"." + CRLF)
+            server.getreply()
+        else:
+            payload = _quote_periods(message)
+            if not payload.endswith(CRLF):
+                payload += CRLF
+            server.send(payload + b"." + CRLF)
+            data_code, data_reply = server.getreply()
+
+    if mail_code != 250:
+        _abort(server, mail_code)
+        raise smtplib.SMTPSenderRefused(mail_code, mail_reply, from_addr)
+    if len(refused) == len(recipients):
+        _abort(server, data_code)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if data_code != 250:
+        _abort(server, data_code)
+        raise smtplib.SMTPDataError(data_code, data_reply)
+    return refused
+
+def _abort(server, code):
+    """Remet la session dans un état propre après un échec (comme sendmail)"""
+    if code == 421:
+        server.close()
+    else:
+        try:
+            server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
@@ -1,5 +1,9 @@
+import time
 import streamlit as st
 from data_manager import save_smtp_configs
+from smtp_pool import DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_RECIPIENTS, get_max_connections
+from smtp_connections import get_connection_manager
+from rate_limiter import get_quota_store, get_send_limits
 
 def smtp_config_section():
     st.header("🔧 Configuration des serveurs SMTP")
@@ -11,6 +15,26 @@ def smtp_config_section():
             smtp_port = st.number_input("Port SMTP*", min_value=1, max_value=65535, value=587)
             smtp_email = st.text_input("Email*")
             smtp_password = st.text_input("Mot de passe*", type="password")
+            max_connections = st.number_input(
+                "Connexions simultanées", min_value=1, max_value=50, value=DEFAULT_MAX_CONNECTIONS,
+                help="Nombre de connexions SMTP ouvertes en parallèle pendant l'envoi (selon la limite du fournisseur)"
+            )
+            max_recipients = st.number_input(
+                "Destinataires max par message", min_value=1, max_value=1000, value=DEFAULT_MAX_RECIPIENTS,
+                help="Limite du serveur pour les envois groupés (RCPT TO par message)"
+            )
+            weight = st.number_input(
+                "Poids", min_value=1, max_value=100, value=1,
+                help="Part des destinataires confiée à ce compte dans une campagne multi-comptes"
+            )
+            st.caption("Limites d'envoi (0 = limite connue du fournisseur, ou aucune)")
+            limit_col1, limit_col2, limit_col3 = st.columns(3)
+            with limit_col1:
+                rate_per_minute = st.number_input("Envois max par minute", min_value=0, value=0)
+            with limit_col2:
+                hourly_quota = st.number_input("Quota horaire", min_value=0, value=0)
+            with limit_col3:
+                daily_quota = st.number_input("Quota journalier", min_value=0, value=0)
 
             submitted = st.form_submit_button("Sauvegarder")
             if submitted:
@@ -19,7 +43,13 @@ def smtp_config_section():
                         "server": smtp_server,
                         "port": smtp_port,
                         "email": smtp_email,
-                        "password": smtp_password
+                        "password": smtp_password,
+                        "max_connections": int(max_connections),
+                        "weight": int(weight),
+                        "max_recipients": int(max_recipients),
+                        "rate_per_minute": int(rate_per_minute),
+                        "hourly_quota": int(hourly_quota),
+                        "daily_quota": int(daily_quota)
                     }
                     save_smtp_configs(st.session_state.smtp_configs)
                     st.success("Configuration SMTP sauvegardée!")
@@ -33,6 +63,26 @@ def smtp_config_section():
                 st.write(f"**Serveur:** {config['server']}")
                 st.write(f"**Port:** {config['port']}")
                 st.write(f"**Email:** {config['email']}")
+                st.write(f"**Connexions simultanées:** {get_max_connections(config)}")
+
+                limits = get_send_limits(config)
+                hour_count, day_count = get_quota_store().usage(config)
+                if limits["rate_per_minute"]:
+                    st.write(f"**Cadence max:** {limits['rate_per_minute']} envois/min")
+                st.write(f"**Envois cette heure:** {hour_count}" + (f" / {limits['hourly_quota']}" if limits["hourly_quota"] else ""))
+                st.write(f"**Envois aujourd'hui:** {day_count}" + (f" / {limits['daily_quota']}" if limits["daily_quota"] else ""))
+
+                if st.button("🧪 Tester la connexion", key=f"test_smtp_{config_name}"):
+                    # La connexion testée reste ouverte et sera réutilisée par le prochain envoi
+                    manager = get_connection_manager()
+                    start = time.perf_counter()
+                    try:
+                        server = manager.acquire(config)
+                        manager.release(config, server)
+                        elapsed = (time.perf_counter() - start) * 1000
+                        st.success(f"✅ Connexion prête en {elapsed:.0f} ms ({manager.idle_count(config)} connexion(s) active(s))")
+                    except Exception as e:
+                        st.error(f"❌ Échec de connexion: {str(e)}")
 
                 if st.button(f"Supprimer {config_name}", key=f"del_{config_name}"):
                     del st.session_state.smtp_configs[config_name]
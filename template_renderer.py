@@ -0,0 +1,76 @@
+import re
+from functools import lru_cache
+
+# Syntaxe des variables selon le canal : [var] pour les emails, {var} pour les SMS
+VARIABLE_PATTERNS = {
+    "email": re.compile(r'\[(.*?)\]'),
+    "sms": re.compile(r'\{(.*?)\}'),
+}
+
+def extract_template_variables(*texts, syntax="email"):
+    """Liste ordonnée et sans doublon des variables présentes dans les textes"""
+    pattern = VARIABLE_PATTERNS[syntax]
+    variables = {}
+    for text in texts:
+        for var in pattern.findall(text or ""):
+            variables.setdefault(var, None)
+    return tuple(variables)
+
+class CompiledTemplate:
+    """Template découpé une seule fois en segments : texte fixe + emplacements de variables.
+
+    Le rendu d'un destinataire se fait en un seul `"".join(...)`, au lieu d'un
+    `str.replace` par variable sur tout le template.
+    """
+
+    def __init__(self, text, syntax="email", variables=None):
+        text = text or ""
+        pattern = VARIABLE_PATTERNS[syntax]
+        self.text = text
+        self.syntax = syntax
+        self.variables = tuple(variables) if variables is not None else extract_template_variables(text, syntax=syntax)
+        index = {var: i for i, var in enumerate(self.variables)}
+
+        # Segments : texte fixe aux positions paires, variables aux positions impaires
+        self._parts = []
+        self._slots = []
+        position = 0
+        for match in pattern.finditer(text):
+            self._parts.append(text[position:match.start()])
+            var = match.group(1)
+            if var in index:
+                self._slots.append((len(self._parts), index[var]))
+                self._parts.append(match.group(0))
+            else:
+                # Variable non demandée : laissée telle quelle
+                self._parts.append(match.group(0))
+            position = match.end()
+        self._parts.append(text[position:])
+
+        if not self._slots:
+            self._static = "".join(self._parts)
+        else:
+            self._static = None
+
+    @property
+    def is_static(self):
+        """Vrai si le template ne contient aucune variable à remplacer"""
+        return self._static is not None
+
+    def render(self, values):
+        """Rend le template avec un tuple de valeurs dans l'ordre de `variables`"""
+        if self._static is not None:
+            return self._static
+        parts = self._parts.copy()
+        for position, var_index in self._slots:
+            parts[position] = values[var_index]
+        return "".join(parts)
+
+    def render_mapping(self, values):
+        """Rend le template avec un dictionnaire {variable: valeur}"""
+        return self.render(tuple(str(values.get(var, "")) for var in self.variables))
+
+@lru_cache(maxsize=128)
+def compile_template(text, syntax="email", variables=None):
+    """Compile (avec cache) un template email ([var]) ou SMS ({var})"""
+    return CompiledTemplate(text, syntax, variables)